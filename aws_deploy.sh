@@ -28,18 +28,19 @@ sudo touch /var/log/anonimvaqti-bot.error.log
 sudo chown ubuntu:ubuntu /var/log/anonimvaqti-bot.*
 
 # Copy service file to systemd
-sudo cp anonimvaqti-bot.service /etc/systemd/system/
+sudo cp anonimvaqti-bot@.service /etc/systemd/system/
 sudo systemctl daemon-reload
 
-# Start and enable the service
-sudo systemctl enable anonimvaqti-bot
-sudo systemctl start anonimvaqti-bot
+# Start and enable the service in the blue slot; bash handoff.sh restarts
+# without downtime by moving the bot to the other slot
+sudo systemctl enable anonimvaqti-bot@blue
+sudo systemctl start anonimvaqti-bot@blue
 
 echo "Checking service status..."
-sudo systemctl status anonimvaqti-bot
+sudo systemctl status 'anonimvaqti-bot@*'
 
 echo "Deployment complete! Bot should be running."
 echo "To check logs:"
-echo "  sudo journalctl -u anonimvaqti-bot -f"
+echo "  sudo journalctl -u 'anonimvaqti-bot@*' -f"
 echo "To check service status:"
-echo "  sudo systemctl status anonimvaqti-bot" 
\ No newline at end of file
+echo "  sudo systemctl status 'anonimvaqti-bot@*'" 
\ No newline at end of file
@@ -1,18 +1,53 @@
 import os
+import sys
+import json
+import signal
+import re
+import copy
+import sqlite3
+import threading
 import logging
+import logging.handlers
+import queue
+import random
+import contextvars
 import datetime
 from datetime import timezone
 import hashlib
+import html
+import io
+import csv
+import tempfile
+import time
+import heapq
+import cProfile
+import pstats
+import tracemalloc
+import collections
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # Python before 3.11
+    import sre_parse
+from collections.abc import MutableMapping
 import secrets
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineQueryResultArticle, InputTextMessageContent, BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, InlineQueryHandler
-from telegram.error import TimedOut, NetworkError
+import base64
+import struct
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineQueryResultArticle, InputTextMessageContent, BotCommand, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
+from telegram import __version_info__ as telegram_version
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, InlineQueryHandler, TypeHandler
+from telegram.error import TimedOut, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
 import pymongo
 from bson import ObjectId
 import asyncio
 from uuid import uuid4
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne, UpdateOne, UpdateMany, DeleteMany
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, BulkWriteError, OperationFailure
+from bson import json_util
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import ssl
 import certifi
 
@@ -22,12 +57,89 @@ load_dotenv()
 # Admin user ID (your Telegram user ID)
 ADMIN_USER_ID = 1153468531
 
+# Logging settings. Handlers only put records on a bounded queue; a
+# listener thread formats them as JSON lines and writes them to stderr.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').strip().upper()
+LOG_QUEUE_SIZE = 10000
+LOG_MAX_MESSAGE_LENGTH = 2000
+# Fraction of INFO (and lower) records kept for high-volume loggers
+LOG_SAMPLE_RATES = {
+    'httpx': 0.05
+}
+
+# Id of the update being handled, attached to every log record and DB call
+correlation_id = contextvars.ContextVar('correlation_id', default='-')
+
+def redact(text: str) -> str:
+    """Describe user content in logs without revealing it"""
+    if text is None:
+        return 'None'
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:8]
+    return f"<redacted {len(text)} chars {digest}>"
+
+class ContextFilter(logging.Filter):
+    """Attach the correlation id and sample high-volume INFO logs"""
+
+    def filter(self, record):
+        if record.levelno <= logging.INFO:
+            rate = LOG_SAMPLE_RATES.get(record.name.split('.')[0])
+            if rate is not None and random.random() >= rate:
+                return False
+        record.correlation_id = correlation_id.get()
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Only resolve the message here; formatting happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON with bounded message size"""
+
+    def format(self, record):
+        message = record.msg if isinstance(record.msg, str) else str(record.msg)
+        if len(message) > LOG_MAX_MESSAGE_LENGTH:
+            message = message[:LOG_MAX_MESSAGE_LENGTH] + f"... ({len(message)} chars)"
+        data = {
+            'ts': datetime.datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'correlation_id': getattr(record, 'correlation_id', '-'),
+            'msg': message
+        }
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)[-LOG_MAX_MESSAGE_LENGTH:]
+        return json.dumps(data, ensure_ascii=False, default=str)
+
 # Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+log_queue = queue.Queue(LOG_QUEUE_SIZE)
+log_handler = NonBlockingQueueHandler(log_queue)
+log_handler.addFilter(ContextFilter())
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(JsonFormatter())
+log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+# An unknown level would make basicConfig raise and keep the bot from starting
+log_level = LOG_LEVEL if isinstance(logging.getLevelName(LOG_LEVEL), int) else 'INFO'
+logging.basicConfig(level=log_level, handlers=[log_handler])
+log_listener.start()
 logger = logging.getLogger(__name__)
+if log_level != LOG_LEVEL:
+    logger.warning(f"Unknown LOG_LEVEL {LOG_LEVEL!r}, using INFO")
 
 # Set event loop policy at the start
 asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
@@ -36,27 +148,1447 @@ def get_utc_now():
     """Get current UTC time in a timezone-aware way"""
     return datetime.datetime.now(timezone.utc)
 
-# MongoDB setup with increased timeout
+# Degraded mode settings. After DB_FAILURE_THRESHOLD failed or slow calls
+# the circuit opens: reads are served from the document caches and writes
+# are appended to a local journal, which is replayed once MongoDB is back.
+DB_FAILURE_THRESHOLD = 3
+DB_RESET_SECONDS = 30
+DB_SLOW_CALL_SECONDS = 2
+DB_CACHE_SIZE = 10000
+DB_REPLAY_CHECK_SECONDS = 5
+DB_REPLAY_BATCH_SIZE = 500
+DB_REPLAY_LEASE_SECONDS = 60
+JOURNAL_PATH = os.getenv('JOURNAL_PATH', 'bot.journal.sqlite3')
+journal_replayer = None
+
+class DatabaseUnavailable(Exception):
+    """Raised when MongoDB can't serve a call and there is no cached answer"""
+
+class CircuitBreaker:
+    """Tracks consecutive database failures and fails fast while MongoDB is down"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """Whether a call may be attempted; half-open lets a trial call through"""
+        return self.state != 'open'
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Database circuit closed")
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                logger.warning(f"Database circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+def call_database(func, *args, count_slow: bool = False, **kwargs):
+    """Run a MongoDB call through the circuit breaker"""
+    if not database_breaker.allow():
+        raise DatabaseUnavailable("Database circuit is open")
+
+    started = time.monotonic()
+    try:
+        result = func(*args, **kwargs)
+    except (ConnectionFailure, ExecutionTimeout) as e:
+        database_breaker.record_failure()
+        raise DatabaseUnavailable(str(e)) from e
+
+    if count_slow and time.monotonic() - started > DB_SLOW_CALL_SECONDS:
+        database_breaker.record_failure()
+    else:
+        database_breaker.record_success()
+    return result
+
+class WriteJournal:
+    """Append-only local journal (SQLite in WAL mode) of writes MongoDB couldn't take.
+
+    The blue and green instances share the file, so the pending entries are
+    always counted from it, and only the holder of the replay lease replays
+    and deletes them.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.owner = uuid4().hex
+        # Entries this instance appended; counting the table on every
+        # journaled write would get slower as an outage goes on
+        self.appended = 0
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "collection TEXT NOT NULL, "
+            "operation TEXT NOT NULL, "
+            "payload TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS replay_lease ("
+            "id INTEGER PRIMARY KEY CHECK (id = 1), "
+            "owner TEXT NOT NULL, "
+            "expires_at REAL NOT NULL)"
+        )
+
+    @property
+    def pending(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+    def has_pending(self) -> bool:
+        with self.lock:
+            return bool(self.connection.execute("SELECT EXISTS (SELECT 1 FROM journal)").fetchone()[0])
+
+    def append(self, collection: str, operation: str, payload: dict):
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO journal (collection, operation, payload) VALUES (?, ?, ?)",
+                (collection, operation, json_util.dumps(payload))
+            )
+            self.appended += 1
+
+    def acquire_lease(self) -> bool:
+        """Take or renew the replay lease, unless another instance holds an unexpired one"""
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute("SELECT owner, expires_at FROM replay_lease").fetchone()
+                if row and row[0] != self.owner and row[1] > now:
+                    return False
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO replay_lease (id, owner, expires_at) VALUES (1, ?, ?)",
+                    (self.owner, now + DB_REPLAY_LEASE_SECONDS)
+                )
+                return True
+            finally:
+                self.connection.execute("COMMIT")
+
+    def release_lease(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM replay_lease WHERE owner = ?", (self.owner,))
+
+    def read_batch(self, limit: int) -> list:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, collection, operation, payload FROM journal ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [(entry_id, collection, operation, json_util.loads(payload))
+                for entry_id, collection, operation, payload in rows]
+
+    def commit_through(self, entry_id: int):
+        """Drop every entry up to and including entry_id once it is in MongoDB"""
+        with self.lock:
+            self.connection.execute("DELETE FROM journal WHERE id <= ?", (entry_id,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def is_degraded() -> bool:
+    """Whether writes should go to the journal instead of MongoDB"""
+    # Entries journaled by another instance count too; writing past them
+    # would let their later replay overwrite newer data
+    return write_journal.has_pending() or not database_breaker.allow()
+
+def matches_query(document: dict, query: dict) -> bool:
+    """Evaluate a plain equality query (arrays match on membership) against a document"""
+    for field, value in query.items():
+        actual = document.get(field)
+        if actual != value and not (isinstance(actual, list) and value in actual):
+            return False
+    return True
+
+def evaluate_filter(document: dict, query: dict) -> bool:
+    """Evaluate a write filter against a cached document; None if it can't be done locally"""
+    for field, condition in query.items():
+        if field.startswith('$'):
+            return None
+        if isinstance(condition, dict):
+            if list(condition) != ['$in']:
+                return None
+            actual = document.get(field)
+            actual_values = actual if isinstance(actual, list) else [actual]
+            if not any(value in condition['$in'] for value in actual_values):
+                return False
+        elif not matches_query(document, {field: condition}):
+            return False
+    return True
+
+# The operators apply_update can replay on a cached document
+APPLIED_UPDATE_OPERATORS = {'$set', '$setOnInsert', '$unset', '$addToSet', '$pull'}
+
+def apply_update(document: dict, update: dict, inserting: bool = False):
+    """Apply the update operators this bot uses to a cached document"""
+    for operator, fields in update.items():
+        for field, value in fields.items():
+            if operator == '$set' or (operator == '$setOnInsert' and inserting):
+                document[field] = value
+            elif operator == '$unset':
+                document.pop(field, None)
+            elif operator == '$addToSet':
+                values = document.setdefault(field, [])
+                if value not in values:
+                    values.append(value)
+            elif operator == '$pull':
+                document[field] = [v for v in document.get(field, []) if v != value]
+
+class JournaledResult:
+    """Stand-in for a pymongo write result when the write went to the journal.
+
+    The counts are None when the outcome can't be told from the cache.
+    """
+    acknowledged = False
+
+    def __init__(self, inserted_id=None, matched_count: int = 0, modified_count: int = 0,
+                 upserted_id=None, deleted_count: int = 0):
+        self.inserted_id = inserted_id
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+        self.deleted_count = deleted_count
+
+class ResilientCollection:
+    """A MongoDB collection behind the circuit breaker, journal and document cache.
+
+    Lookups by one of the key fields always fetch and cache the whole
+    document, so the same lookups can be answered from the cache while
+    the database is unavailable. Other calls are passed through the
+    circuit breaker unchanged.
+    """
+
+    def __init__(self, collection, key_fields: tuple = (), fail_open: bool = False):
+        self.collection = collection
+        # "database.collection", so journaled writes replay into the right tenant
+        self.name = collection.full_name
+        self.key_fields = key_fields
+        # Answer cache misses with "no document" instead of an error while degraded
+        self.fail_open = fail_open
+        self.cache = collections.OrderedDict()
+        # _id -> cached document, so a delete, which only carries the _id,
+        # finds its document without a scan. Evicted documents are left in
+        # it, checked on lookup and pruned once it grows past the cache.
+        self.ids = {}
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def guarded(*args, **kwargs):
+            return call_database(attribute, *args, **kwargs)
+        return guarded
+
+    def _cache_key(self, query) -> tuple:
+        if not isinstance(query, dict) or any(isinstance(v, dict) for v in query.values()):
+            return None
+        for field in self.key_fields:
+            if field in query:
+                return field, query[field]
+        return None
+
+    def _remember(self, key: tuple, document: dict):
+        if document is None:
+            self.cache[key] = None
+            self.cache.move_to_end(key)
+        else:
+            for field in self.key_fields:
+                if field in document:
+                    self.cache[(field, document[field])] = document
+                    self.cache.move_to_end((field, document[field]))
+            if '_id' in document:
+                self.ids[document['_id']] = document
+        while len(self.cache) > DB_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        if len(self.ids) > 2 * DB_CACHE_SIZE:
+            self.ids = {d['_id']: d for d in self.cache.values() if d and '_id' in d}
+
+    def find_by_id(self, document_id) -> dict:
+        """Get the cached document with this _id, if it is still cached"""
+        document = self.ids.get(document_id)
+        if document and any(self.cache.get((field, document.get(field))) is document
+                            for field in self.key_fields):
+            return document
+        return None
+
+    def _forget(self, key: tuple):
+        document = self.cache.pop(key, None)
+        if document:
+            for field in self.key_fields:
+                other_key = (field, document.get(field))
+                if self.cache.get(other_key) is document:
+                    del self.cache[other_key]
+
+    def find_one(self, filter=None, *args, **kwargs):
+        key = self._cache_key(filter) if not args and not kwargs else None
+        if key is None:
+            return call_database(self.collection.find_one, filter, *args, **kwargs)
+
+        # While degraded the cache also holds journaled writes MongoDB doesn't have yet
+        if key not in self.cache or not is_degraded():
+            try:
+                document = call_database(self.collection.find_one, {key[0]: key[1]},
+                                         count_slow=True, comment=correlation_id.get())
+                self._forget(key)
+                self._remember(key, document)
+                return dict(document) if document and matches_query(document, filter) else None
+            except DatabaseUnavailable:
+                pass
+
+        if key in self.cache:
+            document = self.cache[key]
+            return dict(document) if document and matches_query(document, filter) else None
+        if self.fail_open:
+            logger.warning(f"No cached {self.name} document for {key}, assuming none")
+            return None
+        raise DatabaseUnavailable(f"No cached {self.name} document for {key}")
+
+    def refresh(self, previous: dict, document: dict):
+        """Replace a cached document that was changed (or deleted, if None) elsewhere"""
+        keys = set()
+        for source in (previous, document):
+            if source:
+                keys.update((field, source[field]) for field in self.key_fields if field in source)
+        # Documents nobody looked up stay out of the cache
+        if not any(key in self.cache for key in keys):
+            return
+
+        for key in keys:
+            self.cache.pop(key, None)
+        if document:
+            self._remember(None, dict(document))
+        else:
+            for key in keys:
+                self._remember(key, None)
+
+    def _write(self, operation: str, payload: dict, func, *args, **kwargs):
+        if not is_degraded():
+            try:
+                return call_database(func, *args, count_slow=True, comment=correlation_id.get(), **kwargs)
+            except DatabaseUnavailable:
+                pass
+        write_journal.append(self.name, operation, payload)
+        logger.info(f"Journaled {operation} on {self.name} ({write_journal.appended} journaled by this instance)")
+        return None
+
+    def insert_one(self, document: dict):
+        # A client-side _id makes the journaled insert replayable as an upsert
+        document.setdefault('_id', ObjectId())
+        result = self._write('insert_one', {'document': document},
+                             self.collection.insert_one, document)
+        self._remember(None, dict(document))
+        return result or JournaledResult(inserted_id=document['_id'])
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False):
+        payload = {'filter': filter, 'update': update, 'upsert': upsert}
+        result = self._write('update_one', payload, self.collection.update_one,
+                             filter, update, upsert=upsert)
+        key = self._cache_key(filter)
+        replayable = set(update) <= APPLIED_UPDATE_OPERATORS
+        if result is not None:
+            if key is None:
+                return result
+            document = self.cache.get(key)
+            if document and replayable and result.matched_count and matches_query(document, filter):
+                self._forget(key)
+                apply_update(document, update)
+                self._remember(key, document)
+                return result
+            # Keep the written document for outages instead of dropping it, so
+            # a fail-open lookup can't miss a blocklist entry that was just added
+            self._forget(key)
+            try:
+                self._remember(key, call_database(self.collection.find_one, {key[0]: key[1]}))
+            except DatabaseUnavailable:
+                pass
+            return result
+
+        # Keep the cache in step with the journaled write so reads see it
+        if key is not None and key not in self.cache and replayable and upsert and self.fail_open:
+            # Fail-open lookups would otherwise miss the write (say, a sender
+            # who was just blocked). The document only holds what this write
+            # sets, which is no worse than the "no document" answer it replaces.
+            document = dict(filter)
+            apply_update(document, update, inserting=True)
+            self._remember(key, document)
+            return JournaledResult(matched_count=None, modified_count=None)
+        if key is None or key not in self.cache or not replayable:
+            if key is not None:
+                self._forget(key)
+            return JournaledResult(matched_count=None, modified_count=None)
+
+        document = self.cache[key]
+        if document is None:
+            if not upsert:
+                return JournaledResult()
+            document = dict(filter)
+            apply_update(document, update, inserting=True)
+            self._forget(key)
+            self._remember(key, document)
+            return JournaledResult(upserted_id=document.get('_id'))
+
+        if not matches_query(document, filter):
+            return JournaledResult()
+        before = copy.deepcopy(document)
+        apply_update(document, update)
+        self._forget(key)
+        self._remember(key, document)
+        return JournaledResult(matched_count=1, modified_count=int(before != document))
+
+    def _cached_matches(self, filter: dict) -> tuple:
+        """Get the cached documents a filter matches, and those it can't be evaluated against"""
+        if len(filter) == 1:
+            field, condition = next(iter(filter.items()))
+            if field in self.key_fields and not isinstance(condition, dict):
+                values = [condition]
+            elif field in self.key_fields and list(condition) == ['$in']:
+                values = condition['$in']
+            else:
+                values = None
+            if values is not None:
+                documents = {id(d): d for d in (self.cache.get((field, v)) for v in values) if d}
+                return list(documents.values()), []
+
+        matched, unknown = {}, {}
+        for document in self.cache.values():
+            if document is None or id(document) in matched or id(document) in unknown:
+                continue
+            outcome = evaluate_filter(document, filter)
+            if outcome is None:
+                unknown[id(document)] = document
+            elif outcome:
+                matched[id(document)] = document
+        return list(matched.values()), list(unknown.values())
+
+    def _forget_document(self, document: dict):
+        for field in self.key_fields:
+            if field in document and self.cache.get((field, document[field])) is document:
+                self._forget((field, document[field]))
+                return
+
+    def _apply_to_cached(self, filter: dict, update: dict = None, upsert: bool = False):
+        """Apply a multi-document update (or delete, without an update) to the matching cached documents"""
+        matched, unknown = self._cached_matches(filter)
+        if update is not None and not set(update) <= APPLIED_UPDATE_OPERATORS:
+            unknown += matched
+            matched = []
+        for document in unknown:
+            self._forget_document(document)
+
+        for document in matched:
+            keys = [(field, document[field]) for field in self.key_fields if field in document]
+            self._forget_document(document)
+            if update is None:
+                for key in keys:
+                    self._remember(key, None)
+            else:
+                document = copy.deepcopy(document)
+                apply_update(document, update)
+                self._remember(None, document)
+
+        # An upsert may have created a document that is cached as missing
+        if upsert:
+            for key in [k for k, d in self.cache.items() if d is None and k[0] in filter]:
+                del self.cache[key]
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False):
+        payload = {'filter': filter, 'update': update, 'upsert': upsert}
+        result = self._write('update_many', payload, self.collection.update_many,
+                             filter, update, upsert=upsert)
+        self._apply_to_cached(filter, update, upsert)
+        return result or JournaledResult()
+
+    def delete_many(self, filter: dict):
+        result = self._write('delete_many', {'filter': filter}, self.collection.delete_many, filter)
+        self._apply_to_cached(filter)
+        return result or JournaledResult()
+
+def replay_journal() -> int:
+    """Replay journaled writes into MongoDB in ordered bulk batches.
+
+    Every journaled operation is idempotent (inserts are replayed as upserts
+    by _id), so a batch that is interrupted can safely be replayed again.
+    Only one instance replays at a time; the others keep journaling behind it.
+    """
+    if not write_journal.acquire_lease():
+        return 0
+    try:
+        return replay_leased_journal()
+    finally:
+        write_journal.release_lease()
+
+def replay_leased_journal() -> int:
+    """Replay the journal while holding, and renewing, the replay lease"""
+    replayed = 0
+    while write_journal.has_pending():
+        batch = write_journal.read_batch(DB_REPLAY_BATCH_SIZE)
+        if not batch:
+            break
+
+        # Consecutive entries for the same collection go into one bulk_write
+        groups = []
+        for entry in batch:
+            if groups and groups[-1][0] == entry[1]:
+                groups[-1][1].append(entry)
+            else:
+                groups.append((entry[1], [entry]))
+
+        for collection_name, entries in groups:
+            # A bulk_write that outlasted the lease may have been taken over
+            if not write_journal.acquire_lease():
+                logger.warning("Journal replay lease was taken over by another instance")
+                return replayed
+
+            # Entries journaled before multi-bot support carry a bare collection name
+            database_name, _, name = collection_name.rpartition('.')
+            collection = client[database_name or DEFAULT_DATABASE][name]
+            operations = []
+            for _, _, operation, payload in entries:
+                if operation == 'insert_one':
+                    document = payload['document']
+                    operations.append(ReplaceOne({'_id': document['_id']}, document, upsert=True))
+                elif operation == 'update_one':
+                    operations.append(UpdateOne(payload['filter'], payload['update'], upsert=payload['upsert']))
+                elif operation == 'update_many':
+                    operations.append(UpdateMany(payload['filter'], payload['update'], upsert=payload['upsert']))
+                elif operation == 'delete_many':
+                    operations.append(DeleteMany(payload['filter']))
+
+            try:
+                call_database(collection.bulk_write, operations, ordered=True)
+            except BulkWriteError as e:
+                # Skip the entry MongoDB rejects instead of retrying it forever.
+                # The write error's op is the journaled document, so it isn't logged.
+                error = e.details['writeErrors'][0]
+                failed = entries[error['index']]
+                logger.error(
+                    f"Dropping journal entry {failed[0]} rejected by MongoDB: "
+                    f"index {error['index']}, code {error.get('code')}: {error.get('errmsg')}"
+                )
+                write_journal.commit_through(failed[0])
+                replayed += error['index']
+                break
+
+            write_journal.commit_through(entries[-1][0])
+            replayed += len(entries)
+
+    return replayed
+
+async def run_journal_replayer():
+    """Replay the journal whenever MongoDB is reachable again"""
+    while True:
+        await asyncio.sleep(DB_REPLAY_CHECK_SECONDS)
+        if not write_journal.has_pending() or not database_breaker.allow():
+            continue
+        try:
+            replayed = await asyncio.to_thread(replay_journal)
+            if replayed:
+                pending = await asyncio.to_thread(lambda: write_journal.pending)
+                logger.info(f"Replayed {replayed} journaled writes ({pending} pending)")
+        except DatabaseUnavailable as e:
+            logger.warning(f"Journal replay paused, database unavailable: {e}")
+        except Exception as e:
+            logger.error(f"Error replaying journal: {e}")
+
+database_breaker = CircuitBreaker(DB_FAILURE_THRESHOLD, DB_RESET_SECONDS)
+write_journal = WriteJournal(JOURNAL_PATH)
+
+# MongoDB setup
 try:
     mongodb_uri = os.getenv('MONGODB_URI')
     if not mongodb_uri:
         raise ValueError("MONGODB_URI environment variable is not set")
     
     client = MongoClient(mongodb_uri,
-                        serverSelectionTimeoutMS=30000,
-                        connectTimeoutMS=20000,
+                        serverSelectionTimeoutMS=5000,
+                        connectTimeoutMS=5000,
                         socketTimeoutMS=20000)
-    
-    # Test the connection
-    client.admin.command('ping')
-    logger.info("Successfully connected to MongoDB!")
 except Exception as e:
     logger.error(f"Failed to connect to MongoDB: {e}")
     raise
-db = client['hushtalkbot']
-users_collection = db['users']
-messages_collection = db['messages']
-blocked_collection = db['blocked']
+
+# Test the connection; without it the bot starts in degraded mode
+try:
+    call_database(client.admin.command, 'ping')
+    logger.info("Successfully connected to MongoDB!")
+except DatabaseUnavailable as e:
+    logger.error(f"MongoDB is unavailable, starting in degraded mode: {e}")
+
+# Multi-bot tenancy. Each bot token is a tenant with its own database on the
+# shared MongoClient; BOT_TENANTS is a JSON list of {"name", "token",
+# "database"} objects and defaults to the single TELEGRAM_BOT_TOKEN bot.
+DEFAULT_DATABASE = 'hushtalkbot'
+BOT_CONNECTION_POOL_SIZE = 64
+
+class Tenant:
+    """One hosted bot: its token, database collections and per-tenant state"""
+
+    def __init__(self, name: str, token: str, database: str):
+        self.name = name
+        self.token = token
+        self.db = client[database]
+        self.collections = {
+            'users': ResilientCollection(self.db['users'], key_fields=('user_id', 'link_code')),
+            'messages': ResilientCollection(self.db['messages'], key_fields=('_id', 'telegram_message_id')),
+            # A blocklist that can't be read during an outage is treated as empty
+            'blocked': ResilientCollection(self.db['blocked'], key_fields=('user_id',), fail_open=True)
+        }
+        self.admin_stats_cache = {'expires': None, 'data': None}
+        self.last_update_id = 0
+        # Set by load_callback_keys once the tenants are loaded
+        self.callback_keys = []
+        # Set by build_application
+        self.application = None
+
+class TenantCollection:
+    """Module-level collection handle resolving to the current tenant's collection"""
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+
+    def __getattr__(self, attribute):
+        return getattr(get_current_tenant().collections[self.collection_name], attribute)
+
+def load_tenants() -> list:
+    """Read the hosted bots from BOT_TENANTS, or fall back to TELEGRAM_BOT_TOKEN"""
+    config = os.getenv('BOT_TENANTS')
+    if not config:
+        return [Tenant('default', os.getenv('TELEGRAM_BOT_TOKEN'), DEFAULT_DATABASE)]
+
+    tenants = []
+    for entry in json.loads(config):
+        name = entry['name']
+        if any(tenant.name == name for tenant in tenants):
+            raise ValueError(f"Duplicate tenant name in BOT_TENANTS: {name}")
+        tenants.append(Tenant(name, entry['token'], entry.get('database', f"{DEFAULT_DATABASE}_{name}")))
+    if not tenants:
+        raise ValueError("BOT_TENANTS doesn't list any bots")
+    return tenants
+
+# Set per update from the application's bot_data; background work without a
+# tenant (startup, journal replay) falls back to the first one
+current_tenant = contextvars.ContextVar('current_tenant', default=None)
+
+def get_current_tenant() -> Tenant:
+    return current_tenant.get() or tenants[0]
+
+tenants = load_tenants()
+users_collection = TenantCollection('users')
+messages_collection = TenantCollection('messages')
+blocked_collection = TenantCollection('blocked')
+# Content filters are shared by all bots and live in the first tenant's database
+filters_collection = ResilientCollection(tenants[0].db['filters'])
+
+# Indexes backing the /inbox keyset pagination (recipient, newest first),
+# the time-window $match of the admin statistics pipelines and the active
+# user counts
+try:
+    for tenant in tenants:
+        tenant.collections['users'].create_index('last_active')
+        tenant.collections['messages'].create_index([
+            ('recipient_id', pymongo.ASCENDING),
+            ('timestamp', pymongo.DESCENDING),
+            ('_id', pymongo.DESCENDING)
+        ])
+        tenant.collections['messages'].create_index('timestamp')
+    filters_collection.create_index(
+        [('kind', pymongo.ASCENDING), ('pattern', pymongo.ASCENDING)],
+        unique=True
+    )
+except Exception as e:
+    logger.warning(f"Failed to create indexes: {e}")
+
+# Cache invalidation settings. Changes other processes (or manual fixes) make
+# to the users and blocked collections are published as typed events to every
+# cache layer: from a change stream on each tenant's database where MongoDB
+# supports it (and the user may open one), otherwise by polling the cached
+# documents. INVALIDATION_SOURCE can force "changestream", "poll" or "local"
+# (changes pushed in-process, for tests) instead of "auto". The resume token
+# of each database is kept in INVALIDATION_STATE_FILE, so no change is missed
+# across restarts.
+INVALIDATION_SOURCE = os.getenv('INVALIDATION_SOURCE', 'auto')
+INVALIDATION_STATE_FILE = os.getenv('INVALIDATION_STATE_FILE', 'bot.invalidation.json')
+INVALIDATION_COLLECTIONS = ('users', 'blocked')
+INVALIDATION_BATCH_SIZE = 500
+INVALIDATION_MAX_AWAIT_MS = 1000
+INVALIDATION_POLL_SECONDS = 15
+INVALIDATION_RETRY_SECONDS = 5
+# The resume token advances after every batch, even an empty one, so it is
+# saved at most this often and on shutdown; changes replayed after a crash
+# only refresh the caches again
+INVALIDATION_SAVE_SECONDS = 30
+# Server error codes: change streams need a replica set; the resume token
+# fell off the oplog (or can't be resumed from for another reason)
+CHANGE_STREAMS_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = (280, 286)
+invalidation_watcher = None
+invalidation_source = None
+
+# Invalidation event kinds
+LINK_CODE_ROTATED = 'link_code_rotated'
+BLOCK_ADDED = 'block_added'
+BLOCK_REMOVED = 'block_removed'
+USER_WIPED = 'user_wiped'
+DOCUMENT_CHANGED = 'document_changed'
+COLLECTION_RESET = 'collection_reset'
+
+class InvalidationEvent:
+    """A change to a cached collection, with the cached and the current document"""
+
+    def __init__(self, kind: str, tenant: Tenant, collection: str, document_id=None,
+                 previous: dict = None, document: dict = None, details: dict = None):
+        self.kind = kind
+        self.tenant = tenant
+        self.collection = collection
+        self.document_id = document_id
+        # The cached copy before the change and the document after it (None once deleted)
+        self.previous = previous
+        self.document = document
+        self.details = details or {}
+
+    def __repr__(self):
+        return f"InvalidationEvent({self.kind}, {self.tenant.name}.{self.collection}, {self.document_id})"
+
+class InvalidationBus:
+    """Delivers batches of invalidation events to every subscribed cache layer"""
+
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def publish(self, events: list):
+        if not events:
+            return
+        for callback in self.subscribers:
+            try:
+                callback(events)
+            except Exception as e:
+                logger.error(f"Error applying invalidation events in {callback.__name__}: {e}")
+
+def find_cached_document(collection: ResilientCollection, change: dict) -> dict:
+    """Find the cached copy of a changed document, if there is one"""
+    document = change.get('fullDocument')
+    if document:
+        for field in collection.key_fields:
+            cached = collection.cache.get((field, document.get(field)))
+            if cached:
+                return cached
+
+    # Deletes only carry the _id, which the cache isn't keyed by
+    document_id = change.get('documentKey', {}).get('_id')
+    if change['operationType'] == 'delete' and document_id is not None:
+        return collection.find_by_id(document_id)
+    return None
+
+def classify_change(change: dict) -> InvalidationEvent:
+    """Turn a change stream document into a typed invalidation event"""
+    tenant = next((t for t in tenants if t.db.name == change['ns']['db']), None)
+    collection_name = change['ns'].get('coll')
+    if tenant is None or collection_name not in INVALIDATION_COLLECTIONS:
+        return None
+
+    operation = change['operationType']
+    if operation not in ('insert', 'update', 'replace', 'delete'):
+        # drop, rename and invalidate: anything cached may be wrong now
+        return InvalidationEvent(COLLECTION_RESET, tenant, collection_name)
+
+    previous = find_cached_document(tenant.collections[collection_name], change)
+    document = change.get('fullDocument') if operation != 'delete' else None
+    document_id = change.get('documentKey', {}).get('_id')
+    description = change.get('updateDescription') or {}
+    updated_fields = description.get('updatedFields') or {}
+    removed_fields = description.get('removedFields') or []
+    kind = DOCUMENT_CHANGED
+    details = {}
+
+    if collection_name == 'users':
+        old_code = previous.get('link_code') if previous else None
+        new_code = document.get('link_code') if document else None
+        if document is None:
+            kind = USER_WIPED
+        elif (previous and old_code != new_code) or (not previous and 'link_code' in updated_fields):
+            kind = LINK_CODE_ROTATED
+            details = {'old_link_code': old_code, 'link_code': new_code}
+        elif 'last_active' in removed_fields or (previous and 'last_active' in previous
+                                                  and 'last_active' not in document):
+            # /cleardb unsets the activity fields of every user
+            kind = USER_WIPED
+
+    elif collection_name == 'blocked':
+        new_blocked = set(document.get('blocked_users', [])) if document else set()
+        if previous:
+            old_blocked = set(previous.get('blocked_users', []))
+            details = {'added': list(new_blocked - old_blocked), 'removed': list(old_blocked - new_blocked)}
+            if details['added']:
+                kind = BLOCK_ADDED
+            elif details['removed']:
+                kind = BLOCK_REMOVED
+        elif operation == 'insert' or any(f.startswith('blocked_users.') for f in updated_fields):
+            kind = BLOCK_ADDED
+        elif document is None or not new_blocked:
+            kind = BLOCK_REMOVED
+
+    return InvalidationEvent(kind, tenant, collection_name, document_id, previous, document, details)
+
+def refresh_document_caches(events: list):
+    """Bring the ResilientCollection caches in line with changes made elsewhere"""
+    for event in events:
+        collection = event.tenant.collections[event.collection]
+        if event.kind == COLLECTION_RESET:
+            collection.cache.clear()
+        else:
+            collection.refresh(event.previous, event.document)
+
+def drop_stale_admin_stats(events: list):
+    """Recompute admin statistics after users were wiped or collections reset"""
+    for event in events:
+        if event.kind in (USER_WIPED, COLLECTION_RESET):
+            event.tenant.admin_stats_cache['data'] = None
+
+invalidation_bus = InvalidationBus()
+invalidation_bus.subscribe(refresh_document_caches)
+invalidation_bus.subscribe(drop_stale_admin_stats)
+
+def load_resume_tokens() -> dict:
+    """Read the database name -> change stream resume token map saved by the last run"""
+    try:
+        with open(INVALIDATION_STATE_FILE) as file:
+            return json_util.loads(file.read()).get('resume_tokens') or {}
+    except (OSError, ValueError):
+        return {}
+
+def save_resume_tokens(tokens: dict):
+    """Atomically save the change stream resume tokens"""
+    temp_file = f"{INVALIDATION_STATE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, 'w') as file:
+            file.write(json_util.dumps({'resume_tokens': tokens}))
+        os.replace(temp_file, INVALIDATION_STATE_FILE)
+    except OSError as e:
+        logger.error(f"Failed to save change stream resume tokens: {e}")
+
+class ChangeStreamSource:
+    """Tails a change stream over the watched collections of each tenant's database.
+
+    Streams are opened per database rather than over the whole cluster, so a
+    user with access to just the tenant databases can open them.
+    """
+
+    def __init__(self, resume_tokens: dict = None):
+        # Database name -> resume token
+        self.resume_tokens = dict(resume_tokens or {})
+        self.read_tokens = dict(self.resume_tokens)
+        self.saved_tokens = dict(self.resume_tokens)
+        self.saved_at = time.monotonic()
+        self.streams = {}
+
+    def open(self, tenant: Tenant):
+        pipeline = [{'$match': {'ns.coll': {'$in': list(INVALIDATION_COLLECTIONS)}}}]
+        self.streams[tenant.db.name] = call_database(
+            tenant.db.watch, pipeline,
+            full_document='updateLookup',
+            resume_after=self.resume_tokens.get(tenant.db.name),
+            max_await_time_ms=INVALIDATION_MAX_AWAIT_MS
+        )
+
+    def read_tenant(self, tenant: Tenant) -> list:
+        name = tenant.db.name
+        try:
+            if name not in self.streams:
+                self.open(tenant)
+            stream = self.streams[name]
+            changes = []
+            change = stream.try_next()
+            while change is not None:
+                changes.append(change)
+                if len(changes) >= INVALIDATION_BATCH_SIZE:
+                    break
+                change = stream.try_next()
+            self.read_tokens[name] = stream.resume_token
+            return changes
+        except OperationFailure as e:
+            if e.code not in CHANGE_STREAM_HISTORY_LOST or name not in self.resume_tokens:
+                raise
+            # Changes were missed, so every document cached for this tenant is suspect
+            logger.warning(f"Change stream on {name} can't resume, resetting its caches: {e}")
+            self.close_stream(name)
+            self.resume_tokens.pop(name)
+            self.read_tokens.pop(name, None)
+            return [{'operationType': 'invalidate', 'ns': {'db': name, 'coll': collection_name}}
+                    for collection_name in INVALIDATION_COLLECTIONS]
+
+    def read_batch(self) -> list:
+        try:
+            changes = []
+            for tenant in tenants:
+                changes += self.read_tenant(tenant)
+            return changes
+        except Exception:
+            # Reopen every stream from the last published position, so the
+            # changes already read from the other databases aren't lost
+            self.close()
+            self.read_tokens = dict(self.resume_tokens)
+            raise
+
+    async def read(self) -> list:
+        return await asyncio.to_thread(self.read_batch)
+
+    def commit(self):
+        """Remember the positions once the changes read so far have been published"""
+        self.resume_tokens.update((name, token) for name, token in self.read_tokens.items()
+                                  if token is not None)
+        if time.monotonic() - self.saved_at >= INVALIDATION_SAVE_SECONDS:
+            self.save()
+
+    def save(self):
+        if self.resume_tokens != self.saved_tokens:
+            save_resume_tokens(self.resume_tokens)
+            self.saved_tokens = dict(self.resume_tokens)
+        self.saved_at = time.monotonic()
+
+    def close_stream(self, name: str):
+        stream = self.streams.pop(name, None)
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def close(self):
+        self.save()
+        for name in list(self.streams):
+            self.close_stream(name)
+
+class PollingSource:
+    """Re-reads the cached documents periodically where change streams aren't available"""
+
+    @staticmethod
+    def fetch_changes(tenant: Tenant, name: str, cached: list) -> list:
+        collection = tenant.collections[name]
+        values = {}
+        for (field, value), _ in cached:
+            values.setdefault(field, []).append(value)
+
+        current = {}
+        for field, field_values in values.items():
+            for start in range(0, len(field_values), INVALIDATION_BATCH_SIZE):
+                batch = field_values[start:start + INVALIDATION_BATCH_SIZE]
+                documents = call_database(lambda: list(collection.collection.find({field: {'$in': batch}})))
+                for document in documents:
+                    current[(field, document.get(field))] = document
+
+        changes, seen = [], set()
+        for key, document in cached:
+            new_document = current.get(key)
+            if new_document == document:
+                continue
+            document_id = (new_document or document)['_id']
+            if document_id in seen:
+                continue
+            seen.add(document_id)
+            changes.append({
+                'operationType': 'delete' if new_document is None else 'replace',
+                'ns': {'db': tenant.db.name, 'coll': name},
+                'documentKey': {'_id': document_id},
+                'fullDocument': new_document
+            })
+        return changes
+
+    async def read(self) -> list:
+        await asyncio.sleep(INVALIDATION_POLL_SECONDS)
+        # While degraded the caches hold journaled writes MongoDB doesn't have yet
+        if is_degraded():
+            return []
+        changes = []
+        for tenant in tenants:
+            for name in INVALIDATION_COLLECTIONS:
+                cached = list(tenant.collections[name].cache.items())
+                if cached:
+                    changes += await asyncio.to_thread(self.fetch_changes, tenant, name, cached)
+        return changes
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+class LocalChangeSource:
+    """In-process stand-in for a change stream, fed with change documents by push()"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def push(self, change: dict):
+        self.queue.put_nowait(change)
+
+    async def read(self) -> list:
+        changes = [await self.queue.get()]
+        while not self.queue.empty() and len(changes) < INVALIDATION_BATCH_SIZE:
+            changes.append(self.queue.get_nowait())
+        return changes
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+def open_invalidation_source():
+    """Create the change source selected by INVALIDATION_SOURCE"""
+    if INVALIDATION_SOURCE == 'local':
+        return LocalChangeSource()
+    if INVALIDATION_SOURCE == 'poll':
+        return PollingSource()
+    return ChangeStreamSource(load_resume_tokens())
+
+async def run_invalidation_watcher():
+    """Publish changes made by other processes to the caches until cancelled"""
+    global invalidation_source
+    invalidation_source = open_invalidation_source()
+    logger.info(f"Cache invalidation source: {type(invalidation_source).__name__}")
+
+    try:
+        while True:
+            try:
+                changes = await invalidation_source.read()
+                # Refreshing now would overwrite journaled writes in the caches
+                while is_degraded():
+                    await asyncio.sleep(DB_REPLAY_CHECK_SECONDS)
+                events = [event for event in map(classify_change, changes) if event]
+                invalidation_bus.publish(events)
+                invalidation_source.commit()
+                if events:
+                    logger.debug(f"Published {len(events)} invalidation events")
+            except OperationFailure as e:
+                # Without a replica set, or without the changeStream privilege on
+                # a tenant database, no change stream will ever open; errors
+                # pymongo can resume from are retried instead
+                if (INVALIDATION_SOURCE == 'auto' and isinstance(invalidation_source, ChangeStreamSource)
+                        and not e.has_error_label('ResumableChangeStreamError')):
+                    if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                        logger.info("Change streams need a replica set, polling cached documents instead")
+                    else:
+                        logger.warning(f"Can't open change streams, polling cached documents instead: {e}")
+                    invalidation_source.close()
+                    invalidation_source = PollingSource()
+                    continue
+                logger.error(f"Error reading cache invalidations: {e}")
+                await asyncio.sleep(INVALIDATION_RETRY_SECONDS)
+            except DatabaseUnavailable as e:
+                logger.warning(f"Cache invalidation paused, database unavailable: {e}")
+                await asyncio.sleep(INVALIDATION_RETRY_SECONDS)
+            except Exception as e:
+                logger.error(f"Error reading cache invalidations: {e}")
+                await asyncio.sleep(INVALIDATION_RETRY_SECONDS)
+    finally:
+        invalidation_source.close()
+
+# Inbox pagination settings
+INBOX_PAGE_SIZE = 10
+INBOX_PREVIEW_LENGTH = 80
+INBOX_PROJECTION = {
+    'type': 1,
+    'content': 1,
+    'caption': 1,
+    'items': 1,
+    'timestamp': 1,
+    'read': 1
+}
+
+# Admin statistics settings
+ADMIN_STATS_CACHE_SECONDS = 300
+ADMIN_STATS_DAYS = 7
+ADMIN_TOP_RECIPIENTS = 10
+ADMIN_EXPORT_BATCH_SIZE = 1000
+# The export is sent as several CSV documents, each under the 50 MB Bot API
+# upload limit; every part is read into memory whole when it is uploaded
+ADMIN_EXPORT_PART_ROWS = 500000
+ADMIN_EXPORT_PART_BYTES = 45 * 1024 * 1024
+
+# On-demand profiling settings. While no session is active the handlers
+# run unwrapped and neither cProfile nor tracemalloc is enabled.
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP_ENTRIES = 25
+profile_session = None
+
+# Per-user context data limits. Users idle for longer than the TTL, or
+# above the size limit in least-recently-used order, are evicted; users
+# with nothing stored are dropped after a short grace period.
+USER_DATA_MAX_USERS = 50000
+USER_DATA_IDLE_SECONDS = 3600
+USER_DATA_EMPTY_IDLE_SECONDS = 60
+USER_DATA_SWEEP_SECONDS = 60
+# python-telegram-bot releases whose private pending-deletion set
+# forget_pending_user_data_deletion knows how to clear
+USER_DATA_PENDING_DELETION_VERSIONS = ((20, 0), (22, 0))
+
+# Content filter settings. Word patterns, and a literal every match of each
+# regex must contain, are matched in one pass by an Aho-Corasick automaton;
+# only the regexes whose literal was found are then run. Both run on
+# normalized text. The pattern list is reloaded when the filters collection
+# changes.
+FILTER_RELOAD_SECONDS = 30
+FILTER_KINDS = ('word', 'regex')
+FILTER_APOSTROPHES = "‘’ʻʼ`´"
+# Text is already casefolded, so regexes can't carry global inline flags
+FILTER_REGEX_GLOBAL_FLAGS = re.compile(r"\(\?[aiLmsux]+\)")
+# Shorter literals would be found in most messages and let their regexes
+# run on nearly every one
+FILTER_REGEX_MIN_LITERAL = 3
+FILTER_REGEX_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+                        getattr(sre_parse, 'POSSESSIVE_REPEAT', sre_parse.MAX_REPEAT))
+# Escapes like \S or \D, and the P of (?P<name>...), are left alone when
+# checking that the rest of a regex is already normalized
+FILTER_REGEX_ESCAPES = re.compile(r"(\\[\x00-\x7f]|\(\?P)")
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'j', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'x', 'ц': 's', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', 'ў': "o'", 'қ': 'q',
+    'ғ': "g'", 'ҳ': 'h'
+}
+NORMALIZE_TABLE = str.maketrans({
+    **CYRILLIC_TO_LATIN,
+    **{apostrophe: "'" for apostrophe in FILTER_APOSTROPHES}
+})
+content_filter = None
+content_filter_signature = None
+content_filter_reloader = None
+
+# Graceful shutdown and instance handoff. A new instance finds the running
+# one through the state file, sends it HANDOFF_SIGNAL and starts polling as
+# soon as the old one has stopped fetching updates, while the old one is
+# still draining. An instance that handed over exits with HANDOFF_EXIT_CODE,
+# which the supervisor configs treat as a clean stop, not as a crash to
+# restart from. A new instance the running one doesn't hand over to in time
+# exits with HANDOFF_FAILED_EXIT_CODE instead of polling next to it; the
+# supervisors don't restart it either, and handoff.sh reports the failure.
+SHUTDOWN_DRAIN_SECONDS = 10
+HANDOFF_STATE_FILE = os.getenv('HANDOFF_STATE_FILE', 'bot.handoff.json')
+HANDOFF_TIMEOUT_SECONDS = 30
+HANDOFF_POLL_SECONDS = 0.05
+HANDOFF_SIGNAL = signal.SIGUSR1
+HANDOFF_EXIT_CODE = 75
+HANDOFF_FAILED_EXIT_CODE = 76
+
+# Digest settings. Once a recipient gets more than DIGEST_RATE_THRESHOLD
+# messages within DIGEST_RATE_WINDOW_SECONDS, further text messages are
+# buffered for DIGEST_WINDOW_SECONDS and delivered as one digest.
+DIGEST_RATE_WINDOW_SECONDS = 60
+DIGEST_RATE_THRESHOLD = 5
+DIGEST_WINDOW_SECONDS = 10
+DIGEST_MAX_ITEMS = 10
+DIGEST_ITEM_LENGTH = 300
+DIGEST_SEND_ATTEMPTS = 3
+# Recognizes the first line of a digest, which a swipe-reply can't answer
+DIGEST_HEADER = re.compile(r"^📨 Sizga \d+ ta yangi anonim xabar keldi!")
+recipient_deliveries = {}
+pending_digests = {}
+
+# Callback tokens. Block, unblock and reply buttons carry the sender id in an
+# AES-GCM token bound to the recipient, so pressing them needs no database
+# read and never reveals the sender. Tokens are also bound to the bot that
+# issued them. CALLBACK_TOKEN_KEYS is a comma separated "key_id:base64_key"
+# list; the first key signs new tokens and the others are only used to read
+# tokens issued before a rotation. Without it every bot derives its own key
+# from its token.
+CALLBACK_TOKEN_TTL_SECONDS = 180 * 24 * 3600
+CALLBACK_NONCE_SIZE = 12
+
+# Media group (album) buffering: items arriving within the debounce window
+# are delivered together as one send_media_group and stored as one message
+ALBUM_DEBOUNCE_SECONDS = 1.5
+ALBUM_MAX_ITEMS = 10
+ALBUM_MEDIA_TYPES = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+    'audio': InputMediaAudio
+}
+pending_albums = {}
+# Album and digest flushes that are scheduled or running; the shutdown drain
+# waits for them, including ones that already took their buffer
+flush_tasks = set()
+# media_group_id -> time until which later items of a filtered album are dropped
+rejected_albums = collections.OrderedDict()
+
+_UNSET = object()
+
+class UserContextData(MutableMapping):
+    """Compact replacement for the per-user context.user_data dict.
+
+    The fields the handlers use are kept in slots; any other key falls back
+    to a dict that is only created when first needed.
+    """
+    __slots__ = ('reply_to', 'last_received_message_id', '_extra')
+    FIELDS = ('reply_to', 'last_received_message_id')
+
+    def __init__(self):
+        self.reply_to = _UNSET
+        self.last_received_message_id = _UNSET
+        self._extra = None
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is _UNSET:
+                raise KeyError(key)
+            return value
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.FIELDS:
+            if getattr(self, key) is _UNSET:
+                raise KeyError(key)
+            setattr(self, key, _UNSET)
+        else:
+            if self._extra is None:
+                raise KeyError(key)
+            del self._extra[key]
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if getattr(self, key) is not _UNSET:
+                yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def clear(self):
+        self.reply_to = _UNSET
+        self.last_received_message_id = _UNSET
+        self._extra = None
+
+    def estimated_size(self) -> int:
+        """Approximate number of bytes held by this entry"""
+        size = sys.getsizeof(self)
+        if self._extra is not None:
+            size += sys.getsizeof(self._extra)
+        return size
+
+    def __repr__(self):
+        return f"UserContextData({dict(self)!r})"
+
+def normalize_text(text: str) -> str:
+    """Normalize text for filtering: casefold, Cyrillic to Latin, one apostrophe"""
+    return text.casefold().translate(NORMALIZE_TABLE)
+
+def is_word_char(char: str) -> bool:
+    """Check whether a character is part of a word (apostrophes included, as in o'g'il)"""
+    return char.isalnum() or char == "'"
+
+def find_required_literal(items) -> str:
+    """Get the longest literal every match of a parsed regex sequence contains"""
+    best, run = "", ""
+    for op, value in items:
+        if op == sre_parse.LITERAL:
+            run += chr(value)
+            continue
+        best, run = max(best, run, key=len), ""
+        if op == sre_parse.SUBPATTERN:
+            # (group, add_flags, del_flags, items)
+            best = max(best, find_required_literal(value[-1]), key=len)
+        elif op in FILTER_REGEX_REPEATS and value[0] >= 1:
+            best = max(best, find_required_literal(value[2]), key=len)
+    return max(best, run, key=len)
+
+def check_filter_regex(pattern: str) -> str:
+    """Get the reason a regex can't go into the content filter, if any"""
+    if FILTER_REGEX_GLOBAL_FLAGS.search(pattern):
+        return "global inline flags are not supported (text is already casefolded)"
+    # Text is normalized before matching, so uppercase or Cyrillic letters
+    # outside escapes could never match
+    literals = FILTER_REGEX_ESCAPES.split(pattern)[::2]
+    if any(normalize_text(literal) != literal for literal in literals):
+        return "use lowercase Latin letters and plain apostrophes only (text is normalized before matching)"
+    try:
+        literal = find_required_literal(sre_parse.parse(pattern))
+    except re.error as e:
+        return str(e)
+    if len(literal) < FILTER_REGEX_MIN_LITERAL:
+        return (f"every match must contain a fixed text of at least {FILTER_REGEX_MIN_LITERAL} "
+                "characters, outside alternatives and optional parts")
+    return None
+
+class ContentFilter:
+    """Matches normalized text against word patterns and regexes in one pass.
+
+    Word patterns are compiled into an Aho-Corasick automaton and only match
+    whole words. Each regex puts a literal its matches must contain into the
+    same automaton and is only run on text where that literal was found, so
+    matching cost depends on the text length and the regexes that could
+    match it, not on the number of patterns.
+    """
+
+    def __init__(self, words: list, regexes: list):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        # Indexes into self.regexes of the regexes whose literal ends at each state
+        self.triggers = [()]
+        self.regexes = []
+        self.size = 0
+
+        for word in words:
+            word = normalize_text(word).strip()
+            if not word:
+                continue
+            node = self.add_literal(word)
+            if word not in self.output[node]:
+                self.output[node] += (word,)
+                self.size += 1
+
+        for pattern in regexes:
+            error = check_filter_regex(pattern)
+            if error:
+                logger.warning(f"Skipping invalid filter regex {pattern!r}: {error}")
+                continue
+            node = self.add_literal(find_required_literal(sre_parse.parse(pattern)))
+            self.triggers[node] += (len(self.regexes),)
+            self.regexes.append(re.compile(pattern))
+        self.size += len(self.regexes)
+
+        # Breadth-first pass to link every state to its longest proper suffix
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self.goto[node].items():
+                queue.append(next_node)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_node] = self.goto[fallback].get(char, 0)
+                self.output[next_node] += self.output[self.fail[next_node]]
+                self.triggers[next_node] += self.triggers[self.fail[next_node]]
+
+    def add_literal(self, literal: str) -> int:
+        """Add a literal to the automaton's trie and get the state it ends in"""
+        node = 0
+        for char in literal:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+                self.triggers.append(())
+            node = next_node
+        return node
+
+    def search(self, text: str) -> str:
+        """Get the first filtered word or regex match in the text, if any"""
+        text = normalize_text(text)
+        goto, fail, output, triggers = self.goto, self.fail, self.output, self.triggers
+        node = 0
+        candidates = set()
+
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for word in output[node]:
+                start = index - len(word) + 1
+                if (start == 0 or not is_word_char(text[start - 1])) and \
+                        (index + 1 == len(text) or not is_word_char(text[index + 1])):
+                    return word
+            if triggers[node]:
+                candidates.update(triggers[node])
+
+        for regex_index in sorted(candidates):
+            match = self.regexes[regex_index].search(text)
+            if match:
+                return match.group(0)
+        return None
+
+def load_callback_keys(tenant: Tenant) -> list:
+    """Load a bot's callback token keys as (key_id, AESGCM) pairs, newest first"""
+    configured = os.getenv('CALLBACK_TOKEN_KEYS')
+    if not configured:
+        # Stable across restarts and changes to BOT_TENANTS, and as secret
+        # as the bot token itself
+        key = hashlib.sha256(b"callback-token:" + (tenant.token or '').encode()).digest()
+        return [(0, AESGCM(key))]
+
+    keys = []
+    for entry in configured.split(','):
+        key_id, key = entry.strip().split(':', 1)
+        # Tokens carry the key id in a single byte
+        key_id = int(key_id)
+        if not 0 <= key_id <= 255:
+            raise ValueError(f"CALLBACK_TOKEN_KEYS key id {key_id} is outside 0-255")
+        if any(key_id == existing for existing, _ in keys):
+            raise ValueError(f"CALLBACK_TOKEN_KEYS lists key id {key_id} more than once")
+        key = base64.urlsafe_b64decode(key + '=' * (-len(key) % 4))
+        keys.append((key_id, AESGCM(key)))
+    return keys
+
+for tenant in tenants:
+    tenant.callback_keys = load_callback_keys(tenant)
+
+def create_callback_token(action: str, sender_id: int, recipient_id: int) -> str:
+    """Encrypt a sender id into a compact token only the recipient's button can use"""
+    tenant = get_current_tenant()
+    key_id, key = tenant.callback_keys[0]
+    nonce = os.urandom(CALLBACK_NONCE_SIZE)
+    expires = int(time.time()) + CALLBACK_TOKEN_TTL_SECONDS
+    associated_data = f"{tenant.name}:{action}:{recipient_id}:{key_id}".encode()
+    ciphertext = key.encrypt(nonce, struct.pack('>QI', sender_id, expires), associated_data)
+    return base64.urlsafe_b64encode(bytes([key_id]) + nonce + ciphertext).rstrip(b'=').decode()
+
+def read_callback_token(action: str, token: str, recipient_id: int) -> int:
+    """Get the sender id from a callback token, or None if it is invalid or expired"""
+    try:
+        tenant = get_current_tenant()
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        key = dict(tenant.callback_keys).get(raw[0])
+        if key is None:
+            return None
+        associated_data = f"{tenant.name}:{action}:{recipient_id}:{raw[0]}".encode()
+        plaintext = key.decrypt(
+            raw[1:1 + CALLBACK_NONCE_SIZE], raw[1 + CALLBACK_NONCE_SIZE:], associated_data
+        )
+        sender_id, expires = struct.unpack('>QI', plaintext)
+    except (ValueError, IndexError, InvalidTag, struct.error):
+        return None
+    if expires < time.time():
+        return None
+    return sender_id
 
 def generate_unique_code():
     """Generate a unique code for user links"""
@@ -137,11 +1669,11 @@ def get_user_stats(user_id: int) -> dict:
         }
     }
 
-def create_share_text(link_code: str) -> str:
+def create_share_text(bot_username: str, link_code: str) -> str:
     """Create share text without bot username mention"""
     return (
         "**Bu havola orqali menga anonim xabar yuborish mumkin:**\n\n"
-        f"t.me/AskinAnonbot?start={link_code}"
+        f"t.me/{bot_username}?start={link_code}"
     )
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -184,7 +1716,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         # Create the anonymous message link
-        user_link = f"t.me/AskinAnonbot?start={link_code}"
+        user_link = f"t.me/{context.bot.username}?start={link_code}"
         share_text = f"**Bu havola orqali menga anonim xabar yuborish mumkin:**\n\n{user_link}"
         
         welcome_message = (
@@ -219,7 +1751,7 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = users_collection.find_one({'user_id': user_id})
         link_code = user.get('link_code', generate_unique_code())
         
-        user_link = f"t.me/AskinAnonbot?start={link_code}"
+        user_link = f"t.me/{context.bot.username}?start={link_code}"
         share_text = f"**Bu havola orqali menga anonim xabar yuborish mumkin:**\n\n{user_link}"
         
         stats_message = (
@@ -252,6 +1784,124 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring."
         )
 
+def encode_inbox_cursor(message: dict) -> str:
+    """Encode a message's (timestamp, _id) position as a compact cursor"""
+    timestamp = message['timestamp'].replace(tzinfo=timezone.utc)
+    return f"{int(timestamp.timestamp() * 1000):x}_{message['_id']}"
+
+def decode_inbox_cursor(cursor: str) -> tuple:
+    """Decode a cursor produced by encode_inbox_cursor"""
+    timestamp_ms, message_id = cursor.split('_')
+    timestamp = datetime.datetime.fromtimestamp(int(timestamp_ms, 16) / 1000, timezone.utc)
+    return timestamp, ObjectId(message_id)
+
+def get_inbox_page(user_id: int, cursor: str = None, direction: str = 'o') -> tuple:
+    """Get one inbox page using keyset pagination on (timestamp, _id).
+
+    Direction 'o' goes to older messages after the cursor, 'n' to newer ones
+    before it. Returns the messages newest first along with flags telling
+    whether older and newer pages exist.
+    """
+    query = {'recipient_id': user_id}
+    newer = direction == 'n'
+
+    if cursor:
+        timestamp, message_id = decode_inbox_cursor(cursor)
+        op = '$gt' if newer else '$lt'
+        query['$or'] = [
+            {'timestamp': {op: timestamp}},
+            {'timestamp': timestamp, '_id': {op: message_id}}
+        ]
+
+    order = pymongo.ASCENDING if newer else pymongo.DESCENDING
+    messages = list(
+        messages_collection.find(query, INBOX_PROJECTION)
+        .sort([('timestamp', order), ('_id', order)])
+        .limit(INBOX_PAGE_SIZE + 1)
+    )
+
+    has_more = len(messages) > INBOX_PAGE_SIZE
+    messages = messages[:INBOX_PAGE_SIZE]
+
+    if newer:
+        messages.reverse()
+        return messages, True, has_more
+    return messages, has_more, cursor is not None
+
+def mark_messages_read(messages: list):
+    """Mark the unread messages of a page as read with a single update"""
+    unread_ids = [m['_id'] for m in messages if not m.get('read')]
+    if unread_ids:
+        messages_collection.update_many(
+            {'_id': {'$in': unread_ids}},
+            {'$set': {'read': True}}
+        )
+
+def format_inbox_entry(message: dict) -> str:
+    """Format one inbox line"""
+    timestamp = message['timestamp'].strftime('%d.%m %H:%M')
+    new_mark = "🆕 " if not message.get('read') else ""
+    message_type = message.get('type')
+
+    if message_type == 'text':
+        preview = message.get('content', '')
+    elif message_type == 'voice':
+        preview = "🎤 Ovozli xabar"
+    elif message_type == 'photo':
+        preview = f"🖼 Rasm {message.get('caption', '')}"
+    elif message_type == 'animation':
+        preview = f"🎞 GIF {message.get('caption', '')}"
+    elif message_type == 'album':
+        preview = f"🖼 Albom ({len(message.get('items', []))} ta fayl) {message.get('caption', '')}"
+    else:
+        preview = "📎 Media"
+
+    preview = preview.strip()
+    if len(preview) > INBOX_PREVIEW_LENGTH:
+        preview = preview[:INBOX_PREVIEW_LENGTH] + "…"
+    return f"{new_mark}<i>{timestamp}</i> — {html.escape(preview)}"
+
+def build_inbox_page(user_id: int, cursor: str = None, direction: str = 'o') -> tuple:
+    """Build the text and navigation buttons of an inbox page"""
+    messages, has_older, has_newer = get_inbox_page(user_id, cursor, direction)
+
+    if not messages:
+        return "📭 Sizda hali anonim xabarlar yo'q.", None
+
+    mark_messages_read(messages)
+
+    lines = ["<b>📥 Anonim xabarlar</b>\n"]
+    lines.extend(format_inbox_entry(m) for m in messages)
+    text = "\n".join(lines)
+
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton(
+            "⬅️ Yangiroq", callback_data=f"inbox_n_{encode_inbox_cursor(messages[0])}"
+        ))
+    if has_older:
+        buttons.append(InlineKeyboardButton(
+            "Eskiroq ➡️", callback_data=f"inbox_o_{encode_inbox_cursor(messages[-1])}"
+        ))
+
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return text, reply_markup
+
+async def inbox_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /inbox command"""
+    try:
+        text, reply_markup = build_inbox_page(update.effective_user.id)
+        await update.message.reply_text(
+            text,
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        logger.error(f"Error in inbox command: {e}")
+        await update.message.reply_text(
+            "Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring."
+        )
+
 async def block_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle blocking a user"""
     try:
@@ -274,11 +1924,340 @@ async def block_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in block command: {e}")
         await update.message.reply_text("An error occurred. Please try again later.")
 
+def extract_album_item(message) -> dict:
+    """Get the type and file_id of a single media group item"""
+    if message.photo:
+        return {'type': 'photo', 'file_id': message.photo[-1].file_id}
+    if message.video:
+        return {'type': 'video', 'file_id': message.video.file_id}
+    if message.document:
+        return {'type': 'document', 'file_id': message.document.file_id}
+    if message.audio:
+        return {'type': 'audio', 'file_id': message.audio.file_id}
+    return None
+
+def start_flush(coroutine) -> asyncio.Task:
+    """Run an album or digest flush as a task the shutdown drain can wait for"""
+    task = asyncio.create_task(coroutine)
+    flush_tasks.add(task)
+    task.add_done_callback(flush_tasks.discard)
+    return task
+
+def buffer_album_item(update: Update, context: ContextTypes.DEFAULT_TYPE, recipient_id: int = None,
+                      reply_to_message_id: int = None, clear_user_data: bool = False) -> bool:
+    """Add a media group item to its pending album and (re)start the debounce timer"""
+    message = update.message
+    item = extract_album_item(message)
+    if not item:
+        return False
+
+    album = pending_albums.get(message.media_group_id)
+    if album is None:
+        if recipient_id is None:
+            return False
+        album = {
+            'sender_id': update.effective_user.id,
+            'sender_chat_id': message.chat_id,
+            'recipient_id': recipient_id,
+            'reply_to_message_id': reply_to_message_id,
+            'user_data': context.user_data if clear_user_data else None,
+            'bot': context.bot,
+            'tenant': get_current_tenant(),
+            'items': [],
+            'caption': None,
+            'task': None
+        }
+        pending_albums[message.media_group_id] = album
+
+    album['items'].append(item)
+    if message.caption and not album['caption']:
+        album['caption'] = message.caption
+
+    # Every new item pushes the flush back, so the whole album is sent at once
+    if album['task']:
+        album['task'].cancel()
+    album['task'] = start_flush(flush_album(message.media_group_id))
+    return True
+
+async def flush_album(media_group_id: str, delay: float = None):
+    """Store a buffered album as one message and deliver it with a single send_media_group"""
+    await asyncio.sleep(ALBUM_DEBOUNCE_SECONDS if delay is None else delay)
+    album = pending_albums.pop(media_group_id, None)
+    if not album:
+        return
+
+    bot = album['bot']
+    current_tenant.set(album['tenant'])
+
+    try:
+        message_data = {
+            'sender_id': album['sender_id'],
+            'recipient_id': album['recipient_id'],
+            'timestamp': get_utc_now(),
+            'read': False,
+            'type': 'album',
+            'media_group_id': media_group_id,
+            'items': album['items']
+        }
+        if album['caption']:
+            message_data['caption'] = album['caption']
+        if album['reply_to_message_id']:
+            message_data['reply_to_message_id'] = album['reply_to_message_id']
+
+        message_id = messages_collection.insert_one(message_data).inserted_id
+
+        media = []
+        for index, item in enumerate(album['items'][:ALBUM_MAX_ITEMS]):
+            caption = album['caption'] if index == 0 else None
+            media_class = ALBUM_MEDIA_TYPES[item['type']]
+            media.append(media_class(media=item['file_id'], caption=caption))
+
+        sent_album = await bot.send_media_group(chat_id=album['recipient_id'], media=media)
+
+        # Albums can't carry inline buttons, so the block button and the reply
+        # target live on a short notice attached to the album
+        reply_markup = InlineKeyboardMarkup([[
+            InlineKeyboardButton("🚫 Bloklash", callback_data=(
+                f"block_{create_callback_token('block', album['sender_id'], album['recipient_id'])}"
+            ))
+        ]])
+        notice_text = (
+            "<b>📨 Sizga yangi anonim xabar keldi!</b>\n\n"
+            f"🖼 Albom: {len(media)} ta fayl\n\n"
+            "↩️ Javob berish uchun xabarni chapga suring"
+        )
+        sent_notice = await bot.send_message(
+            chat_id=album['recipient_id'],
+            text=notice_text,
+            reply_markup=reply_markup,
+            reply_to_message_id=sent_album[0].message_id,
+            parse_mode='HTML'
+        )
+
+        messages_collection.update_one(
+            {'_id': message_id},
+            {'$set': {
+                'telegram_message_id': sent_notice.message_id,
+                'album_message_ids': [m.message_id for m in sent_album]
+            }}
+        )
+
+        success_message = (
+            "<b>✅ Xabaringiz yuborildi</b>\n"
+            "<i>Statistika — /mystats</i>"
+        )
+        await bot.send_message(chat_id=album['sender_chat_id'], text=success_message, parse_mode='HTML')
+        if album['user_data'] is not None:
+            album['user_data'].clear()
+
+    except asyncio.CancelledError:
+        # Shutdown deadline; the album is stored and stays readable in /inbox
+        logger.warning(f"Album {media_group_id} to {album['recipient_id']} cancelled before delivery")
+        raise
+    except Exception as e:
+        logger.error(f"Failed to send album {media_group_id}: {e}")
+        try:
+            await bot.send_message(
+                chat_id=album['sender_chat_id'],
+                text="<i>Xabarni yuborib bo'lmadi. Iltimos, keyinroq qayta urinib ko'ring.</i>",
+                parse_mode='HTML'
+            )
+        except Exception as e:
+            logger.error(f"Failed to notify sender about album {media_group_id}: {e}")
+
+async def flush_pending_albums():
+    """Deliver every buffered album right away, without waiting for the debounce"""
+    for media_group_id in list(pending_albums):
+        album = pending_albums.get(media_group_id)
+        if album and album['task']:
+            album['task'].cancel()
+        await flush_album(media_group_id, delay=0)
+
+def reject_album(media_group_id: str):
+    """Drop items of this album for another debounce window"""
+    rejected_albums[media_group_id] = time.monotonic() + ALBUM_DEBOUNCE_SECONDS
+    rejected_albums.move_to_end(media_group_id)
+
+def is_rejected_album(media_group_id: str) -> bool:
+    """Check whether a media group item belongs to an album refused by the content filter"""
+    now = time.monotonic()
+    while rejected_albums and next(iter(rejected_albums.values())) <= now:
+        rejected_albums.popitem(last=False)
+    return media_group_id in rejected_albums
+
+async def reject_filtered_content(update: Update) -> bool:
+    """Refuse to deliver a message whose text or caption matches the content filter"""
+    text = update.message.text or update.message.caption
+    if not text or content_filter is None:
+        return False
+
+    match = content_filter.search(text)
+    if match is None:
+        return False
+
+    logger.info(f"Filtered message from {update.effective_user.id}: {redact(match)}")
+
+    # Drop the whole album the filtered item belongs to, including items
+    # that arrive after it (the caption usually comes with the first one)
+    media_group_id = update.message.media_group_id
+    if media_group_id:
+        album = pending_albums.pop(media_group_id, None)
+        if album and album['task']:
+            album['task'].cancel()
+        reject_album(media_group_id)
+
+    await update.message.reply_text(
+        "<i>⚠️ Xabaringizda taqiqlangan so'z yoki havola bor. Xabar yuborilmadi.</i>",
+        parse_mode='HTML'
+    )
+    return True
+
+def record_delivery(recipient_id: int) -> bool:
+    """Record a delivery to a recipient and tell whether they are over the digest threshold"""
+    now = time.monotonic()
+    key = (get_current_tenant().name, recipient_id)
+    deliveries = recipient_deliveries.setdefault(key, collections.deque())
+    deliveries.append(now)
+    while deliveries[0] < now - DIGEST_RATE_WINDOW_SECONDS:
+        deliveries.popleft()
+    return len(deliveries) > DIGEST_RATE_THRESHOLD
+
+def prune_recipient_deliveries():
+    """Forget recipients with no deliveries in the rate window"""
+    cutoff = time.monotonic() - DIGEST_RATE_WINDOW_SECONDS
+    for key in [k for k, d in recipient_deliveries.items() if d[-1] < cutoff]:
+        del recipient_deliveries[key]
+
+def should_coalesce(recipient_id: int) -> bool:
+    """Decide whether a text message to this recipient goes into a digest"""
+    hot = record_delivery(recipient_id)
+    if (get_current_tenant().name, recipient_id) in pending_digests:
+        return True
+    if not hot:
+        return False
+    # The setting is only looked up for recipients that are over the threshold
+    recipient = users_collection.find_one({'user_id': recipient_id})
+    return not (recipient and recipient.get('digest_disabled'))
+
+def buffer_digest_item(bot, recipient_id: int, message_id, sender_id: int, sender_chat_id: int, content: str):
+    """Add a text message to the recipient's pending digest"""
+    tenant = get_current_tenant()
+    key = (tenant.name, recipient_id)
+    digest = pending_digests.get(key)
+    if digest is None:
+        digest = {'bot': bot, 'tenant': tenant, 'recipient_id': recipient_id, 'items': [], 'task': None}
+        pending_digests[key] = digest
+        digest['task'] = start_flush(flush_digest(key))
+
+    digest['items'].append({
+        'message_id': message_id,
+        'sender_id': sender_id,
+        'sender_chat_id': sender_chat_id,
+        'content': content
+    })
+
+    if len(digest['items']) >= DIGEST_MAX_ITEMS:
+        digest['task'].cancel()
+        digest['task'] = start_flush(flush_digest(key, delay=0))
+
+async def flush_digest(key: tuple, delay: float = None):
+    """Deliver a recipient's buffered messages as one digest message, then tell the senders"""
+    await asyncio.sleep(DIGEST_WINDOW_SECONDS if delay is None else delay)
+    digest = pending_digests.pop(key, None)
+    if not digest:
+        return
+
+    bot = digest['bot']
+    recipient_id = digest['recipient_id']
+    current_tenant.set(digest['tenant'])
+    items = digest['items']
+    sent_message = None
+    try:
+        lines = [f"<b>📨 Sizga {len(items)} ta yangi anonim xabar keldi!</b>\n"]
+        keyboard = []
+        for number, item in enumerate(items, start=1):
+            content = item['content']
+            if len(content) > DIGEST_ITEM_LENGTH:
+                content = content[:DIGEST_ITEM_LENGTH] + "… (to'liq matn — /inbox)"
+            lines.append(f"<b>{number}.</b> {html.escape(content)}\n")
+            keyboard.append([
+                InlineKeyboardButton(f"↩️ {number}", callback_data=(
+                    f"reply_{create_callback_token('reply', item['sender_id'], recipient_id)}"
+                )),
+                InlineKeyboardButton(f"🚫 {number}", callback_data=(
+                    f"block_{create_callback_token('block', item['sender_id'], recipient_id)}"
+                ))
+            ])
+        lines.append("↩️ Javob berish yoki bloklash uchun raqamli tugmalardan foydalaning")
+
+        for attempt in range(1, DIGEST_SEND_ATTEMPTS + 1):
+            try:
+                sent_message = await bot.send_message(
+                    chat_id=recipient_id,
+                    text="\n".join(lines),
+                    reply_markup=InlineKeyboardMarkup(keyboard),
+                    parse_mode='HTML'
+                )
+                break
+            except RetryAfter as e:
+                if attempt == DIGEST_SEND_ATTEMPTS:
+                    raise
+                logger.warning(f"Digest to {recipient_id} hit flood control, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+
+        messages_collection.update_many(
+            {'_id': {'$in': [item['message_id'] for item in items]}},
+            {'$set': {'digest_message_id': sent_message.message_id}}
+        )
+
+    except asyncio.CancelledError:
+        # Shutdown deadline; the messages are stored and stay readable in /inbox
+        logger.warning(f"Digest of {len(items)} messages to {recipient_id} cancelled before delivery")
+        raise
+    except Exception as e:
+        logger.error(f"Failed to send digest to {recipient_id}: {e}")
+
+    # One notice per sender, however many of their messages the digest held
+    sender_counts = collections.Counter(item['sender_chat_id'] for item in items)
+    for sender_chat_id, count in sender_counts.items():
+        if sent_message is None:
+            text = "<i>Xabarni yuborib bo'lmadi. Iltimos, keyinroq qayta urinib ko'ring.</i>"
+        elif count == 1:
+            text = "<b>✅ Xabaringiz yuborildi</b>\n<i>Statistika — /mystats</i>"
+        else:
+            text = f"<b>✅ {count} ta xabaringiz yuborildi</b>\n<i>Statistika — /mystats</i>"
+        try:
+            await bot.send_message(chat_id=sender_chat_id, text=text, parse_mode='HTML')
+        except Exception as e:
+            logger.error(f"Failed to notify sender about digest to {recipient_id}: {e}")
+
+async def flush_pending_digests():
+    """Deliver every buffered digest right away"""
+    flushes = []
+    for key in list(pending_digests):
+        digest = pending_digests.get(key)
+        if digest and digest['task']:
+            digest['task'].cancel()
+        flushes.append(flush_digest(key, delay=0))
+    # Concurrently, so one slow recipient doesn't use up the drain deadline
+    await asyncio.gather(*flushes)
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle incoming messages"""
     try:
         user_id = update.effective_user.id
-        
+
+        # Later items of an album refused by the content filter
+        if update.message.media_group_id and is_rejected_album(update.message.media_group_id):
+            reject_album(update.message.media_group_id)
+            return
+
+        # Later items of an album that is already being collected
+        if update.message.media_group_id in pending_albums:
+            if not await reject_filtered_content(update):
+                buffer_album_item(update, context)
+            return
+
         # If there's no reply_to in context, it means it's a direct message to bot
         if 'reply_to' not in context.user_data and not update.message.reply_to_message:
             # Generate or get existing link code for the user
@@ -303,7 +2282,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             # Create the anonymous message link
-            user_link = f"t.me/AskinAnonbot?start={link_code}"
+            user_link = f"t.me/{context.bot.username}?start={link_code}"
             share_text = f"**Bu havola orqali menga anonim xabar yuborish mumkin:**\n\n{user_link}"
             
             welcome_message = (
@@ -329,6 +2308,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.message.reply_to_message:
             # Get the original message ID from the replied message
             replied_message = update.message.reply_to_message
+            # A digest holds several senders' messages, so there's no single one to reply to
+            if replied_message.text and DIGEST_HEADER.match(replied_message.text):
+                await update.message.reply_text(
+                    "<i>Bu bir nechta xabar jamlanmasi. Javob berish uchun xabar raqami "
+                    "yozilgan ↩️ tugmasini bosing.</i>",
+                    parse_mode='HTML'
+                )
+                return
             if replied_message and replied_message.text and ("📨 Sizga yangi anonim xabar keldi!" in replied_message.text or 
                                                           "📨 У тебя новое анонимное сообщение!" in replied_message.text):
                 # Find the exact message being replied to
@@ -351,6 +2338,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             parse_mode='HTML'
                         )
                         return
+
+                    if await reject_filtered_content(update):
+                        return
+
+                    # Albums are collected and delivered as a single message
+                    if update.message.media_group_id and buffer_album_item(
+                        update, context, recipient_id, reply_to_message_id=replied_message.message_id
+                    ):
+                        return
                     
                     # Store the message with reference to the message being replied to
                     message_data = {
@@ -380,10 +2376,19 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             message_data['caption'] = update.message.caption
                     
                     message_id = messages_collection.insert_one(message_data).inserted_id
+
+                    # Bursts of text messages to a hot recipient go out as one digest
+                    if message_data['type'] == 'text' and should_coalesce(recipient_id):
+                        # The sender is told once the digest is actually delivered
+                        buffer_digest_item(context.bot, recipient_id, message_id, user_id,
+                                           update.message.chat_id, message_data['content'])
+                        return
                     
                     # Create reply markup for recipient
                     reply_markup = InlineKeyboardMarkup([[
-                        InlineKeyboardButton("🚫 Bloklash", callback_data=f"block_{message_id}")
+                        InlineKeyboardButton("🚫 Bloklash", callback_data=(
+                            f"block_{create_callback_token('block', user_id, recipient_id)}"
+                        ))
                     ]])
                     
                     try:
@@ -393,7 +2398,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         if message_data['type'] == 'text':
                             message_text = (
                                 "<b>📨 Sizga yangi anonim xabar keldi!</b>\n\n"
-                                f"{message_data['content']}\n\n"
+                                f"{html.escape(message_data['content'])}\n\n"
                                 "↩️ Javob berish uchun xabarni chapga suring"
                             )
                             
@@ -422,7 +2427,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             caption = message_data.get('caption', '')
                             photo_caption = (
                                 "<b>📨 Sizga yangi anonim rasm keldi!</b>\n\n"
-                                f"{caption}\n\n"
+                                f"{html.escape(caption)}\n\n"
                                 "↩️ Javob berish uchun xabarni chapga suring"
                             )
                             
@@ -438,7 +2443,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             caption = message_data.get('caption', '')
                             gif_caption = (
                                 "<b>📨 Sizga yangi anonim GIF keldi!</b>\n\n"
-                                f"{caption}\n\n"
+                                f"{html.escape(caption)}\n\n"
                                 "↩️ Javob berish uchun xabarni chapga suring"
                             )
                             
@@ -495,6 +2500,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     parse_mode='HTML'
                 )
                 return
+
+            if await reject_filtered_content(update):
+                return
+
+            # Albums are collected and delivered as a single message
+            if update.message.media_group_id and buffer_album_item(
+                update, context, recipient_id, clear_user_data=True
+            ):
+                return
             
             # Store the message
             message_data = {
@@ -523,10 +2537,20 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     message_data['caption'] = update.message.caption
             
             message_id = messages_collection.insert_one(message_data).inserted_id
+
+            # Bursts of text messages to a hot recipient go out as one digest
+            if message_data['type'] == 'text' and should_coalesce(recipient_id):
+                # The sender is told once the digest is actually delivered
+                buffer_digest_item(context.bot, recipient_id, message_id, user_id,
+                                   update.message.chat_id, message_data['content'])
+                context.user_data.clear()
+                return
             
             # Create reply markup for recipient
             reply_markup = InlineKeyboardMarkup([[
-                InlineKeyboardButton("🚫 Bloklash", callback_data=f"block_{message_id}")
+                InlineKeyboardButton("🚫 Bloklash", callback_data=(
+                    f"block_{create_callback_token('block', user_id, recipient_id)}"
+                ))
             ]])
             
             try:
@@ -536,7 +2560,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 if message_data['type'] == 'text':
                     message_text = (
                         "<b>📨 Sizga yangi anonim xabar keldi!</b>\n\n"
-                        f"{message_data['content']}\n\n"
+                        f"{html.escape(message_data['content'])}\n\n"
                         "↩️ Javob berish uchun xabarni chapga suring"
                     )
                     
@@ -565,7 +2589,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     caption = message_data.get('caption', '')
                     photo_caption = (
                         "<b>📨 Sizga yangi anonim rasm keldi!</b>\n\n"
-                        f"{caption}\n\n"
+                        f"{html.escape(caption)}\n\n"
                         "↩️ Javob berish uchun xabarni chapga suring"
                     )
                     
@@ -573,14 +2597,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         chat_id=recipient_id,
                         photo=message_data['file_id'],
                         caption=photo_caption,
-                        reply_markup=reply_markup
+                        reply_markup=reply_markup,
+                        parse_mode='HTML'
                     )
 
                 elif message_data['type'] == 'animation':
                     caption = message_data.get('caption', '')
                     gif_caption = (
                         "<b>📨 Sizga yangi anonim GIF keldi!</b>\n\n"
-                        f"{caption}\n\n"
+                        f"{html.escape(caption)}\n\n"
                         "↩️ Javob berish uchun xabarni chapga suring"
                     )
                     
@@ -629,7 +2654,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if query.data.startswith('forward_'):
             # Get the link code from the callback data
             link_code = query.data.split('_')[1]
-            user_link = f"t.me/AskinAnonbot?start={link_code}"
+            user_link = f"t.me/{context.bot.username}?start={link_code}"
             
             # Create the message that will be forwarded
             share_text = (
@@ -651,14 +2676,19 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.answer("Выберите, куда переслать сообщение")
             
         elif query.data.startswith('block_'):
-            message_id = query.data.split('_')[1]
+            token = query.data.split('_', 1)[1]
             user_id = query.from_user.id
-            
-            # Find the message
-            message = messages_collection.find_one({'_id': ObjectId(message_id)})
-            if message:
-                sender_id = message['sender_id']
-                
+
+            if ObjectId.is_valid(token):
+                # Buttons sent before callback tokens carry the message id
+                message = messages_collection.find_one({'_id': ObjectId(token)})
+                sender_id = message['sender_id'] if message else None
+            else:
+                sender_id = read_callback_token('block', token, user_id)
+
+            if sender_id is None:
+                await query.message.reply_text("⌛ Bu tugma eskirgan.")
+            else:
                 # Add sender to blocked users
                 blocked_collection.update_one(
                     {'user_id': user_id},
@@ -669,15 +2699,53 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     upsert=True
                 )
                 
-                await query.edit_message_text(
+                block_text = (
                     "✅ Foydalanuvchi bloklandi.\n"
                     "Endi u sizga xabar yubora olmaydi.\n\n"
                     "Blokdan chiqarish uchun /blacklist buyrug'ini ishlating."
                 )
+                unblock_markup = InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔓 Blokdan chiqarish", callback_data=(
+                        f"unblock_{create_callback_token('unblock', sender_id, user_id)}"
+                    ))
+                ]])
+                # A digest holds other senders' messages too, so keep it intact
+                if len(query.message.reply_markup.inline_keyboard) > 1:
+                    await query.message.reply_text(block_text, reply_markup=unblock_markup)
+                else:
+                    await query.edit_message_text(block_text, reply_markup=unblock_markup)
+
+        elif query.data.startswith('reply_'):
+            sender_id = read_callback_token('reply', query.data.split('_', 1)[1], query.from_user.id)
+            if sender_id is None:
+                await query.message.reply_text("⌛ Bu tugma eskirgan.")
+            else:
+                context.user_data['reply_to'] = sender_id
+                await query.message.reply_text(
+                    "<i>Javobingizni yuboring. Bu matn, ovozli xabar yoki media bo'lishi mumkin 🎭</i>",
+                    parse_mode='HTML'
+                )
+                
+        elif query.data.startswith('inbox_'):
+            _, direction, cursor = query.data.split('_', 2)
+            text, reply_markup = build_inbox_page(query.from_user.id, cursor, direction)
+            await query.edit_message_text(
+                text,
+                reply_markup=reply_markup,
+                parse_mode='HTML'
+            )
                 
         elif query.data.startswith('unblock_'):
-            sender_id = int(query.data.split('_')[1])
+            token = query.data.split('_', 1)[1]
             user_id = update.effective_user.id
+
+            if token.isdigit():
+                sender_id = int(token)
+            else:
+                sender_id = read_callback_token('unblock', token, user_id)
+            if sender_id is None:
+                await query.message.reply_text("⌛ Bu tugma eskirgan.")
+                return
             
             # Remove user from blocked list
             result = blocked_collection.update_one(
@@ -685,7 +2753,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 {'$pull': {'blocked_users': sender_id}}
             )
             
-            if result.modified_count > 0:
+            if result.modified_count is None:
+                await query.message.reply_text(
+                    "✅ So'rovingiz qabul qilindi, foydalanuvchi tez orada blokdan chiqariladi."
+                )
+            elif result.modified_count > 0:
                 await query.message.reply_text(
                     "✅ Foydalanuvchi blokdan chiqarildi va endi sizga xabar yubora oladi."
                 )
@@ -698,6 +2770,352 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in button callback: {e}")
         await query.edit_message_text("Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring.")
 
+def get_user_data_access(application) -> collections.OrderedDict:
+    """Get the application's user id -> last access time map, least recent first"""
+    return application.bot_data.setdefault('user_data_access', collections.OrderedDict())
+
+def forget_pending_user_data_deletion(application, user_id: int):
+    """Take a dropped user off the application's list of deletions for persistence.
+
+    Without persistence nothing ever flushes that list, so it would grow by
+    one id per eviction. python-telegram-bot has no public way to do this;
+    the private set is only touched on the releases it is known to exist in.
+    """
+    if application.persistence is not None:
+        return
+    oldest, newest = USER_DATA_PENDING_DELETION_VERSIONS
+    if not oldest <= tuple(telegram_version[:2]) < newest:
+        return
+    pending = getattr(application, '_user_ids_to_be_deleted_in_persistence', None)
+    if isinstance(pending, set):
+        pending.discard(user_id)
+
+def evict_user_data(application, user_id: int):
+    """Drop a user's context data and forget their last access"""
+    get_user_data_access(application).pop(user_id, None)
+    application.drop_user_data(user_id)
+    forget_pending_user_data_deletion(application, user_id)
+
+async def track_user_data_access(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Record user activity and enforce the size limit on stored context data"""
+    user = update.effective_user
+    if not user:
+        return
+
+    user_data_access = get_user_data_access(context.application)
+    user_data_access[user.id] = time.monotonic()
+    user_data_access.move_to_end(user.id)
+
+    while len(user_data_access) > USER_DATA_MAX_USERS:
+        user_id = next(iter(user_data_access))
+        evict_user_data(context.application, user_id)
+
+def sweep_user_data(application) -> int:
+    """Evict idle users' context data, oldest first"""
+    now = time.monotonic()
+    evicted = 0
+
+    for user_id, last_access in list(get_user_data_access(application).items()):
+        idle = now - last_access
+        if idle < USER_DATA_EMPTY_IDLE_SECONDS:
+            break
+        if idle >= USER_DATA_IDLE_SECONDS or not application.user_data.get(user_id):
+            evict_user_data(application, user_id)
+            evicted += 1
+
+    return evicted
+
+def get_user_data_metrics(application) -> dict:
+    """Get the number of users with resident context data and its estimated size"""
+    user_data = application.user_data
+    estimated_bytes = sys.getsizeof(get_user_data_access(application))
+    for user_id, data in user_data.items():
+        estimated_bytes += sys.getsizeof(user_id)
+        if isinstance(data, UserContextData):
+            estimated_bytes += data.estimated_size()
+        else:
+            estimated_bytes += sys.getsizeof(data)
+    return {
+        'resident_users': len(user_data),
+        'estimated_bytes': estimated_bytes
+    }
+
+async def run_user_data_sweeper(application):
+    """Periodically evict idle users' context data"""
+    while True:
+        await asyncio.sleep(USER_DATA_SWEEP_SECONDS)
+        try:
+            prune_recipient_deliveries()
+            evicted = sweep_user_data(application)
+            if evicted:
+                metrics = get_user_data_metrics(application)
+                logger.info(
+                    f"Evicted {evicted} idle users' context data; "
+                    f"{metrics['resident_users']} resident, ~{metrics['estimated_bytes']} bytes"
+                )
+        except Exception as e:
+            logger.error(f"Error sweeping user data: {e}")
+
+def get_content_filter_signature() -> tuple:
+    """Get a cheap signature that changes whenever filter patterns are added or removed"""
+    newest = filters_collection.find_one({}, {'_id': 1}, sort=[('_id', pymongo.DESCENDING)])
+    return filters_collection.count_documents({}), newest['_id'] if newest else None
+
+def build_content_filter() -> ContentFilter:
+    """Build the content filter from the patterns stored in the database"""
+    words, regexes = [], []
+    for pattern in filters_collection.find({}, {'_id': 0, 'kind': 1, 'pattern': 1}):
+        if pattern['kind'] == 'regex':
+            regexes.append(pattern['pattern'])
+        else:
+            words.append(pattern['pattern'])
+    return ContentFilter(words, regexes)
+
+async def reload_content_filter(force: bool = False):
+    """Rebuild the content filter if its patterns changed, off the event loop"""
+    global content_filter, content_filter_signature
+
+    signature = await asyncio.to_thread(get_content_filter_signature)
+    if not force and signature == content_filter_signature:
+        return
+
+    # Handlers keep using the old automaton until the new one is swapped in
+    content_filter = await asyncio.to_thread(build_content_filter)
+    content_filter_signature = signature
+    logger.info(f"Content filter loaded with {content_filter.size} patterns")
+
+async def run_content_filter_reloader():
+    """Periodically pick up pattern changes made by other instances or by hand"""
+    while True:
+        await asyncio.sleep(FILTER_RELOAD_SECONDS)
+        try:
+            await reload_content_filter()
+        except Exception as e:
+            logger.error(f"Error reloading content filter: {e}")
+
+async def start_background_tasks():
+    """Start the background tasks shared by all bots"""
+    global content_filter_reloader, journal_replayer, invalidation_watcher
+    journal_replayer = asyncio.create_task(run_journal_replayer())
+    invalidation_watcher = asyncio.create_task(run_invalidation_watcher())
+
+    try:
+        await reload_content_filter(force=True)
+    except Exception as e:
+        logger.error(f"Error loading content filter: {e}")
+    content_filter_reloader = asyncio.create_task(run_content_filter_reloader())
+
+def stop_background_tasks():
+    """Stop the background tasks shared by all bots"""
+    for task in (content_filter_reloader, journal_replayer, invalidation_watcher):
+        if task:
+            task.cancel()
+
+async def post_init(application):
+    """Start the bot's own background tasks once the application is initialized"""
+    application.bot_data['user_data_sweeper'] = asyncio.create_task(run_user_data_sweeper(application))
+
+async def post_stop(application):
+    """Stop the bot's own background tasks"""
+    task = application.bot_data.get('user_data_sweeper')
+    if task:
+        task.cancel()
+
+async def track_update_offset(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Select the update's tenant, remember its latest update id and tag its logs"""
+    tenant = context.bot_data['tenant']
+    tenant.last_update_id = max(tenant.last_update_id, update.update_id)
+    # Handlers of this update, and tasks they start, inherit the tenant and the id
+    current_tenant.set(tenant)
+    correlation_id.set(f"{tenant.name}:u{update.update_id}")
+
+def read_handoff_state() -> dict:
+    """Read the handoff state file, if there is one"""
+    try:
+        with open(HANDOFF_STATE_FILE) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def get_process_identity(pid: int) -> str:
+    """Get the boot id and start time of a process, which unlike its pid are never reused"""
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as file:
+            boot_id = file.read().strip()
+        with open(f'/proc/{pid}/stat') as file:
+            # The command name may contain spaces, the fields after it don't
+            start_time = file.read().rsplit(')', 1)[1].split()[19]
+        return f"{boot_id}:{start_time}"
+    except (OSError, IndexError):
+        return None
+
+def write_handoff_state(state: str):
+    """Atomically write this instance's handoff state"""
+    data = {
+        'pid': os.getpid(),
+        'process': get_process_identity(os.getpid()),
+        'state': state,
+        'last_update_id': {tenant.name: tenant.last_update_id for tenant in tenants},
+        'updated_at': get_utc_now().isoformat()
+    }
+    temp_file = f"{HANDOFF_STATE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, 'w') as file:
+            json.dump(data, file)
+        os.replace(temp_file, HANDOFF_STATE_FILE)
+    except OSError as e:
+        logger.error(f"Failed to write handoff state: {e}")
+
+def is_process_alive(pid: int) -> bool:
+    """Check whether a process with the given pid exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def is_handoff_owner_alive(state: dict) -> bool:
+    """Check that the instance named in the state file is still running as that same process"""
+    pid = state.get('pid')
+    if not pid or pid == os.getpid() or not is_process_alive(pid):
+        return False
+    # A file left behind by a crash, kill -9 or reboot may name a pid that
+    # now belongs to an unrelated process
+    identity = get_process_identity(pid)
+    return identity is not None and identity == state.get('process')
+
+class HandoffFailed(Exception):
+    """The running instance didn't release polling in time"""
+
+async def take_over_polling():
+    """Ask a running instance to release polling and wait until it does.
+
+    Raises HandoffFailed if it doesn't: two instances polling at once only
+    get 409 Conflict errors from Telegram.
+    """
+    state = read_handoff_state()
+    if not state or not is_handoff_owner_alive(state):
+        return
+
+    old_pid = state['pid']
+    if state.get('state') == 'running':
+        logger.info(f"Asking running instance {old_pid} to hand over")
+        os.kill(old_pid, HANDOFF_SIGNAL)
+
+    started = time.monotonic()
+    while time.monotonic() - started < HANDOFF_TIMEOUT_SECONDS:
+        state = read_handoff_state()
+        if not state or state.get('pid') != old_pid or state.get('state') != 'running':
+            break
+        if not is_process_alive(old_pid):
+            break
+        await asyncio.sleep(HANDOFF_POLL_SECONDS)
+    else:
+        raise HandoffFailed(f"Instance {old_pid} did not hand over in {HANDOFF_TIMEOUT_SECONDS}s")
+
+    logger.info(f"Took over polling from instance {old_pid} after {time.monotonic() - started:.3f}s")
+
+async def drain(applications: list):
+    """Finish queued and in-flight updates, then deliver buffered albums and digests"""
+    # Processes everything left in the update queues and waits for handlers
+    await asyncio.gather(*(application.stop() for application in applications))
+    await flush_pending_albums()
+    await flush_pending_digests()
+    # Flushes that had already taken their buffer, e.g. in the middle of a
+    # send or waiting out flood control
+    while flush_tasks:
+        await asyncio.wait(list(flush_tasks))
+
+async def cancel_flush_tasks():
+    """Cancel flushes still running after the drain deadline and wait until they stop"""
+    tasks = list(flush_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def shutdown_gracefully(applications: list):
+    """Stop intake, release polling to a replacement and drain with a deadline"""
+    logger.info("Shutting down: stopping intake")
+
+    # Cancels the long polls and confirms every fetched update to Telegram,
+    # so a replacement instance won't receive them again
+    await asyncio.gather(*(application.updater.stop() for application in applications))
+    write_handoff_state('released')
+
+    try:
+        await asyncio.wait_for(drain(applications), timeout=SHUTDOWN_DRAIN_SECONDS)
+        offsets = ", ".join(f"{tenant.name}: {tenant.last_update_id}" for tenant in tenants)
+        logger.info(f"Drained; last processed updates {offsets}")
+    except asyncio.TimeoutError:
+        logger.warning(f"Drain did not finish within {SHUTDOWN_DRAIN_SECONDS}s")
+    # Before the shared request pool is closed under them
+    await cancel_flush_tasks()
+
+    # A replacement may already own the state file by now
+    state = read_handoff_state()
+    if not state or state.get('pid') == os.getpid():
+        write_handoff_state('stopped')
+
+    stop_background_tasks()
+    # Every bot has drained, so the first shutdown may close the shared request pool
+    for application in applications:
+        try:
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.shutdown()
+        except Exception as e:
+            logger.error(f"Error during application shutdown: {e}")
+
+async def run_bot(applications: list, commands: list) -> bool:
+    """Run all bots until SIGINT/SIGTERM or a handoff, then shut them down gracefully.
+
+    Returns whether the bots were handed over to a new instance.
+    """
+    stop_event = asyncio.Event()
+    handed_over = asyncio.Event()
+
+    def hand_over():
+        handed_over.set()
+        stop_event.set()
+
+    loop = asyncio.get_running_loop()
+    for sig, handler in ((signal.SIGINT, stop_event.set), (signal.SIGTERM, stop_event.set),
+                         (HANDOFF_SIGNAL, hand_over)):
+        try:
+            loop.add_signal_handler(sig, handler)
+        except NotImplementedError:
+            pass
+
+    for application in applications:
+        await application.initialize()
+        await application.bot.set_my_commands(commands)
+        if application.post_init:
+            await application.post_init(application)
+    await start_background_tasks()
+
+    try:
+        await take_over_polling()
+    except HandoffFailed:
+        stop_background_tasks()
+        for application in applications:
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.shutdown()
+        raise
+    for application in applications:
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        logger.info(f"Bot @{application.bot.username} ({application.bot_data['tenant'].name}) is running")
+    write_handoff_state('running')
+
+    await stop_event.wait()
+    if handed_over.is_set():
+        logger.info("Handing over to a new instance")
+    await shutdown_gracefully(applications)
+    return handed_over.is_set()
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors"""
     try:
@@ -708,7 +3126,10 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring."
                 )
         else:
-            logger.error(f"Update {update} caused error {context.error}")
+            logger.error(
+                f"Update {getattr(update, 'update_id', None)} caused error: {context.error}",
+                exc_info=context.error
+            )
             if update and update.effective_message:
                 await update.effective_message.reply_text(
                     "❌ Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring."
@@ -737,7 +3158,7 @@ async def url_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         # Create the new anonymous message link
-        user_link = f"t.me/AskinAnonbot?start={new_link_code}"
+        user_link = f"t.me/{context.bot.username}?start={new_link_code}"
         
         await update.message.reply_text(
             f"✅ Sizning yangi havolangiz:\n\n{user_link}"
@@ -747,6 +3168,32 @@ async def url_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in url command: {e}")
         await update.message.reply_text("Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring.")
 
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /digest command"""
+    try:
+        user_id = update.effective_user.id
+        user = users_collection.find_one({'user_id': user_id})
+        digest_disabled = not (user and user.get('digest_disabled'))
+
+        users_collection.update_one(
+            {'user_id': user_id},
+            {'$set': {'digest_disabled': digest_disabled}},
+            upsert=True
+        )
+
+        if digest_disabled:
+            await update.message.reply_text(
+                "🔔 Xabarlarni jamlash o'chirildi. Har bir xabar alohida keladi."
+            )
+        else:
+            await update.message.reply_text(
+                "📦 Xabarlarni jamlash yoqildi. Ko'p xabar kelganda ular bitta xabarda jamlanadi."
+            )
+
+    except Exception as e:
+        logger.error(f"Error in digest command: {e}")
+        await update.message.reply_text("Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring.")
+
 async def issue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /issue command"""
     try:
@@ -781,7 +3228,7 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             link_code = user_data['link_code']
         
-        user_link = f"t.me/AskinAnonbot?start={link_code}"
+        user_link = f"t.me/{context.bot.username}?start={link_code}"
         share_text = f"**Bu havola orqali menga anonim xabar yuborish mumkin:**\n\n{user_link}"
         
         results = [
@@ -827,7 +3274,9 @@ async def blacklist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             {'$set': {'blocked_users': []}}
         )
         
-        if result.modified_count > 0:
+        if result.modified_count is None:
+            await update.message.reply_text("✅ So'rovingiz qabul qilindi, ro'yxat tez orada tozalanadi.")
+        elif result.modified_count > 0:
             await update.message.reply_text("✅ Bloklangan foydalanuvchilar ro'yxati tozalandi.")
         else:
             await update.message.reply_text("ℹ️ Bloklangan foydalanuvchilar ro'yxati bo'sh.")
@@ -836,6 +3285,462 @@ async def blacklist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in blacklist command: {e}")
         await update.message.reply_text("Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring.")
 
+def compute_admin_stats() -> dict:
+    """Compute bot-wide statistics with server-side aggregation pipelines"""
+    now = get_utc_now()
+    day_ago = now - datetime.timedelta(days=1)
+    period_start = (now - datetime.timedelta(days=ADMIN_STATS_DAYS - 1)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+
+    # Active users either sent a message or updated last_active (/start, /url,
+    # inline queries, messages to the bot itself) in the window; senders who
+    # only ever used someone's link have no users document
+    active = list(users_collection.aggregate([
+        {'$match': {'last_active': {'$gte': period_start}}},
+        {'$project': {'_id': 0, 'user_id': 1, 'at': '$last_active'}},
+        {'$unionWith': {'coll': messages_collection.name, 'pipeline': [
+            {'$match': {'timestamp': {'$gte': period_start}}},
+            {'$group': {'_id': '$sender_id', 'at': {'$max': '$timestamp'}}},
+            {'$project': {'_id': 0, 'user_id': '$_id', 'at': 1}}
+        ]}},
+        {'$group': {'_id': '$user_id', 'at': {'$max': '$at'}}},
+        {'$facet': {
+            'dau': [{'$match': {'at': {'$gte': day_ago}}}, {'$count': 'users'}],
+            'wau': [{'$count': 'users'}]
+        }}
+    ]))[0]
+    dau = active['dau'][0]['users'] if active['dau'] else 0
+    wau = active['wau'][0]['users'] if active['wau'] else 0
+
+    # One pass over the indexed time window feeds every message metric
+    facets = list(messages_collection.aggregate([
+        {'$match': {'timestamp': {'$gte': period_start}}},
+        {'$facet': {
+            'per_day': [
+                {'$group': {
+                    '_id': {
+                        'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}},
+                        'type': '$type'
+                    },
+                    'count': {'$sum': 1}
+                }},
+                {'$sort': {'_id.day': 1, '_id.type': 1}}
+            ],
+            'top_recipients': [
+                {'$group': {'_id': '$recipient_id', 'count': {'$sum': 1}}},
+                {'$sort': {'count': -1}},
+                {'$limit': ADMIN_TOP_RECIPIENTS}
+            ],
+            'total': [
+                {'$count': 'messages'}
+            ]
+        }}
+    ]))[0]
+
+    blocks = list(blocked_collection.aggregate([
+        {'$project': {'count': {'$size': {'$ifNull': ['$blocked_users', []]}}}},
+        {'$match': {'count': {'$gt': 0}}},
+        {'$group': {
+            '_id': None,
+            'blocking_users': {'$sum': 1},
+            'blocked_pairs': {'$sum': '$count'}
+        }}
+    ]))
+    blocks = blocks[0] if blocks else {'blocking_users': 0, 'blocked_pairs': 0}
+
+    total_users = users_collection.estimated_document_count()
+    total_messages = messages_collection.estimated_document_count()
+
+    per_day = {}
+    for row in facets['per_day']:
+        day = per_day.setdefault(row['_id']['day'], {})
+        day[row['_id'].get('type') or 'unknown'] = row['count']
+
+    return {
+        'generated_at': now,
+        'dau': dau,
+        'wau': wau,
+        'period_messages': facets['total'][0]['messages'] if facets['total'] else 0,
+        'per_day': per_day,
+        'top_recipients': [(row['_id'], row['count']) for row in facets['top_recipients']],
+        'total_users': total_users,
+        'total_messages': total_messages,
+        'blocking_users': blocks['blocking_users'],
+        'blocked_pairs': blocks['blocked_pairs'],
+        'block_rate': (blocks['blocked_pairs'] / total_messages * 100) if total_messages else 0
+    }
+
+def get_admin_stats() -> dict:
+    """Get admin statistics, recomputing them at most once per cache TTL"""
+    now = get_utc_now()
+    admin_stats_cache = get_current_tenant().admin_stats_cache
+    if admin_stats_cache['data'] is None or admin_stats_cache['expires'] <= now:
+        admin_stats_cache['data'] = compute_admin_stats()
+        admin_stats_cache['expires'] = now + datetime.timedelta(seconds=ADMIN_STATS_CACHE_SECONDS)
+    return admin_stats_cache['data']
+
+def open_export_part(parts: list) -> tuple:
+    """Start a new temporary CSV part file with its own header row"""
+    file = tempfile.TemporaryFile(mode='w+b')
+    parts.append([file, 0])
+    text_file = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    writer = csv.writer(text_file)
+    # writerow returns the characters written, which are all ASCII here
+    size = writer.writerow(['user_id', 'received', 'sent'])
+    return text_file, writer, size
+
+def close_export_part(text_file):
+    """Flush a part and leave its binary file open for the upload"""
+    text_file.flush()
+    text_file.detach()
+
+def write_user_activity_csv(parts: list) -> int:
+    """Stream per-user message counts into CSV part files, row by row.
+
+    Appends a [file, rows] pair to parts for every ADMIN_EXPORT_PART_ROWS
+    rows or ADMIN_EXPORT_PART_BYTES bytes; the caller closes the files.
+    """
+    text_file, writer, size = open_export_part(parts)
+
+    cursor = messages_collection.aggregate([
+        {'$project': {'_id': 0, 'pairs': [
+            {'user_id': '$recipient_id', 'received': 1, 'sent': 0},
+            {'user_id': '$sender_id', 'received': 0, 'sent': 1}
+        ]}},
+        {'$unwind': '$pairs'},
+        {'$group': {
+            '_id': '$pairs.user_id',
+            'received': {'$sum': '$pairs.received'},
+            'sent': {'$sum': '$pairs.sent'}
+        }},
+        {'$sort': {'received': -1}}
+    ], allowDiskUse=True, batchSize=ADMIN_EXPORT_BATCH_SIZE)
+
+    rows = 0
+    for row in cursor:
+        if parts[-1][1] >= ADMIN_EXPORT_PART_ROWS or size >= ADMIN_EXPORT_PART_BYTES:
+            close_export_part(text_file)
+            text_file, writer, size = open_export_part(parts)
+        size += writer.writerow([row['_id'], row['received'], row['sent']])
+        parts[-1][1] += 1
+        rows += 1
+    close_export_part(text_file)
+    return rows
+
+async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /adminstats command - only available to admin"""
+    try:
+        if update.effective_user.id != ADMIN_USER_ID:
+            await update.message.reply_text(
+                "❌ Bu buyruq faqat admin uchun."
+            )
+            return
+
+        stats = await asyncio.to_thread(get_admin_stats)
+        memory = get_user_data_metrics(context.application)
+
+        per_day_lines = []
+        for day, types in stats['per_day'].items():
+            counts = ", ".join(f"{t}: {c}" for t, c in types.items())
+            per_day_lines.append(f"{day} — {counts}")
+
+        top_lines = [
+            f"{position}. <code>{user_id}</code> — {count}"
+            for position, (user_id, count) in enumerate(stats['top_recipients'], start=1)
+        ]
+
+        stats_message = (
+            f"<b>📊 @{context.bot.username} statistikasi</b>\n\n"
+            f"👥 Foydalanuvchilar: {stats['total_users']}\n"
+            f"💬 Xabarlar: {stats['total_messages']}\n"
+            f"📅 DAU: {stats['dau']}\n"
+            f"📆 WAU: {stats['wau']}\n\n"
+            f"━ Kunlik xabarlar ({ADMIN_STATS_DAYS} kun, jami {stats['period_messages']}):\n"
+            + ("\n".join(per_day_lines) or "—") + "\n\n"
+            "━ Eng ko'p xabar olganlar:\n"
+            + ("\n".join(top_lines) or "—") + "\n\n"
+            f"🚫 Bloklaganlar: {stats['blocking_users']}\n"
+            f"🚫 Bloklangan juftliklar: {stats['blocked_pairs']}\n"
+            f"🚫 100 xabarga bloklar: {stats['block_rate']:.2f}\n\n"
+            f"🧠 Xotiradagi foydalanuvchilar: {memory['resident_users']} "
+            f"(~{memory['estimated_bytes'] // 1024} KiB)\n\n"
+            f"<i>Yangilangan: {stats['generated_at'].strftime('%Y-%m-%d %H:%M')} UTC</i>\n"
+            "<i>To'liq eksport — /adminexport</i>"
+        )
+
+        await update.message.reply_text(stats_message, parse_mode='HTML')
+
+    except Exception as e:
+        logger.error(f"Error in admin stats command: {e}")
+        await update.message.reply_text(
+            "Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring."
+        )
+
+async def admin_export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /adminexport command - only available to admin"""
+    try:
+        if update.effective_user.id != ADMIN_USER_ID:
+            await update.message.reply_text(
+                "❌ Bu buyruq faqat admin uchun."
+            )
+            return
+
+        # Rows go straight from the aggregation cursor to temporary part
+        # files on disk; only the part being uploaded is held in memory
+        parts = []
+        try:
+            rows = await asyncio.to_thread(write_user_activity_csv, parts)
+            stamp = get_utc_now().strftime('%Y%m%d_%H%M')
+            for number, (file, part_rows) in enumerate(parts, start=1):
+                file.seek(0)
+                if len(parts) == 1:
+                    filename = f"user_activity_{stamp}.csv"
+                    caption = f"📄 {rows} ta foydalanuvchi"
+                else:
+                    filename = f"user_activity_{stamp}_part{number}.csv"
+                    caption = f"📄 {number}/{len(parts)}-qism: {part_rows} ta foydalanuvchi (jami {rows})"
+                await update.message.reply_document(document=file, filename=filename, caption=caption)
+        finally:
+            for file, _ in parts:
+                file.close()
+
+    except Exception as e:
+        logger.error(f"Error in admin export command: {e}")
+        await update.message.reply_text(
+            "Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring."
+        )
+
+def get_update_type(update) -> str:
+    """Get a short name for the kind of update a handler received"""
+    for update_type in ('message', 'edited_message', 'callback_query', 'inline_query'):
+        if getattr(update, update_type, None):
+            return update_type
+    return 'other'
+
+def wrap_handler_callback(callback, timings: list, tenant_name: str):
+    """Wrap a handler callback so every invocation's duration is recorded"""
+    async def timed_callback(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            duration = time.perf_counter() - started
+            entry = (duration, callback.__name__, get_update_type(update), tenant_name)
+            # Keep only the slowest invocations
+            if len(timings) < PROFILE_TOP_ENTRIES:
+                heapq.heappush(timings, entry)
+            elif duration > timings[0][0]:
+                heapq.heapreplace(timings, entry)
+    return timed_callback
+
+def start_profiling(application, seconds: int):
+    """Enable cProfile, tracemalloc and handler timing of every bot for a bounded window"""
+    global profile_session
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    tracemalloc.start()
+
+    timings = []
+    wrapped = []
+    for tenant in tenants:
+        for handlers in tenant.application.handlers.values():
+            for handler in handlers:
+                wrapped.append((handler, handler.callback))
+                handler.callback = wrap_handler_callback(handler.callback, timings, tenant.name)
+
+    profile_session = {
+        'profiler': profiler,
+        'start_snapshot': tracemalloc.take_snapshot(),
+        'started_at': get_utc_now(),
+        'seconds': seconds,
+        'timings': timings,
+        'wrapped': wrapped,
+        'task': asyncio.create_task(finish_profiling(application.bot, seconds))
+    }
+
+def stop_profiling() -> dict:
+    """Disable cProfile and restore the handlers; the session stays set until its report is built"""
+    session = profile_session
+    session['stopped'] = True
+    session['stopped_at'] = get_utc_now()
+    session['profiler'].disable()
+    for handler, callback in session['wrapped']:
+        handler.callback = callback
+    return session
+
+def build_profile_report(session: dict) -> str:
+    """Stop tracemalloc and build the text report; slow on a large heap, so run in a thread"""
+    end_snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    cpu_report = io.StringIO()
+    pstats.Stats(session['profiler'], stream=cpu_report).sort_stats('cumulative').print_stats(PROFILE_TOP_ENTRIES)
+
+    allocation_lines = [
+        str(stat) for stat in end_snapshot.compare_to(session['start_snapshot'], 'lineno')[:PROFILE_TOP_ENTRIES]
+    ]
+
+    handler_lines = [
+        f"{duration * 1000:10.1f} ms  {name}  ({update_type}, {tenant_name})"
+        for duration, name, update_type, tenant_name in sorted(session['timings'], reverse=True)
+    ]
+
+    return "\n".join([
+        f"Profile started {session['started_at'].strftime('%Y-%m-%d %H:%M:%S')} UTC, "
+        f"stopped {session['stopped_at'].strftime('%Y-%m-%d %H:%M:%S')} UTC",
+        "",
+        "=== Slowest handler invocations ===",
+        *(handler_lines or ["(no updates handled)"]),
+        "",
+        "=== Top allocation sites (growth during the window) ===",
+        *(allocation_lines or ["(no allocations recorded)"]),
+        "",
+        "=== Top functions by cumulative time ===",
+        cpu_report.getvalue()
+    ])
+
+async def send_profile_report(bot, report: str):
+    """Send a profiling report to the admin as a text file"""
+    await bot.send_document(
+        chat_id=ADMIN_USER_ID,
+        document=report.encode('utf-8'),
+        filename=f"profile_{get_utc_now().strftime('%Y%m%d_%H%M%S')}.txt",
+        caption="🩺 Profil hisoboti"
+    )
+
+async def report_profiling(bot):
+    """Stop the profiling session and send its report, built off the event loop"""
+    global profile_session
+    try:
+        report = await asyncio.to_thread(build_profile_report, stop_profiling())
+    finally:
+        profile_session = None
+    await send_profile_report(bot, report)
+
+async def finish_profiling(bot, seconds: int):
+    """Stop the profiling session once its window is over"""
+    await asyncio.sleep(seconds)
+    if profile_session is None or profile_session.get('stopped'):
+        return
+    try:
+        await report_profiling(bot)
+    except Exception as e:
+        logger.error(f"Error finishing profiling: {e}")
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /profile command - only available to admin"""
+    try:
+        if update.effective_user.id != ADMIN_USER_ID:
+            await update.message.reply_text(
+                "❌ Bu buyruq faqat admin uchun."
+            )
+            return
+
+        argument = context.args[0] if context.args else None
+
+        if argument == 'stop':
+            if profile_session is None or profile_session.get('stopped'):
+                await update.message.reply_text("ℹ️ Profil yozilmayapti.")
+                return
+            profile_session['task'].cancel()
+            await report_profiling(context.bot)
+            return
+
+        if profile_session is not None:
+            await update.message.reply_text(
+                "ℹ️ Profil allaqachon yozilmoqda. To'xtatish uchun /profile stop"
+            )
+            return
+
+        seconds = int(argument) if argument else PROFILE_DEFAULT_SECONDS
+        seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+        start_profiling(context.application, seconds)
+        await update.message.reply_text(
+            f"🩺 Profil {seconds} soniya davomida yoziladi. Hisobot shu yerga yuboriladi."
+        )
+
+    except ValueError:
+        await update.message.reply_text(
+            f"ℹ️ Foydalanish: /profile [1-{PROFILE_MAX_SECONDS} soniya | stop]"
+        )
+    except Exception as e:
+        logger.error(f"Error in profile command: {e}")
+        await update.message.reply_text(
+            "Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring."
+        )
+
+async def filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /filter command - only available to admin"""
+    try:
+        if update.effective_user.id != ADMIN_USER_ID:
+            await update.message.reply_text(
+                "❌ Bu buyruq faqat admin uchun."
+            )
+            return
+
+        action = context.args[0] if context.args else None
+        pattern = " ".join(context.args[1:]).strip()
+
+        if action in ('add', 'regex') and pattern:
+            kind = 'regex' if action == 'regex' else 'word'
+            if kind == 'regex':
+                error = check_filter_regex(pattern)
+                if error:
+                    await update.message.reply_text(f"❌ Noto'g'ri regex: {error}")
+                    return
+            else:
+                pattern = normalize_text(pattern)
+            filters_collection.update_one(
+                {'kind': kind, 'pattern': pattern},
+                {'$setOnInsert': {'created_at': get_utc_now()}},
+                upsert=True
+            )
+            await reload_content_filter(force=True)
+            await update.message.reply_text(f"✅ Filtrga qo'shildi: {pattern}")
+
+        elif action == 'del' and pattern:
+            result = filters_collection.delete_many({
+                'pattern': {'$in': [pattern, normalize_text(pattern)]}
+            })
+            await reload_content_filter(force=True)
+            if result.deleted_count:
+                await update.message.reply_text(f"✅ Filtrdan o'chirildi: {pattern}")
+            else:
+                await update.message.reply_text("❌ Bunday qoida topilmadi.")
+
+        elif action == 'test' and pattern:
+            match = content_filter.search(pattern) if content_filter else None
+            if match is None:
+                await update.message.reply_text("✅ Matn filtrdan o'tdi.")
+            else:
+                await update.message.reply_text(f"🚫 Filtrga tushdi: {match}")
+
+        elif action == 'reload':
+            await reload_content_filter(force=True)
+            await update.message.reply_text(
+                f"✅ Filtr qayta yuklandi: {content_filter.size} ta qoida."
+            )
+
+        else:
+            counts = {kind: filters_collection.count_documents({'kind': kind}) for kind in FILTER_KINDS}
+            await update.message.reply_text(
+                f"🛡 Filtr: {counts['word']} ta so'z, {counts['regex']} ta regex\n\n"
+                "/filter add <so'z yoki domen>\n"
+                "/filter regex <ifoda>\n"
+                "/filter del <qoida>\n"
+                "/filter test <matn>\n"
+                "/filter reload"
+            )
+
+    except Exception as e:
+        logger.error(f"Error in filter command: {e}")
+        await update.message.reply_text(
+            "Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring."
+        )
+
 async def clear_db_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /cleardb command - only available to admin"""
     try:
@@ -864,6 +3769,12 @@ async def clear_db_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             }
         )
 
+        # Other processes learn about the wipe from the change stream
+        tenant = get_current_tenant()
+        invalidation_bus.publish([
+            InvalidationEvent(COLLECTION_RESET, tenant, name) for name in INVALIDATION_COLLECTIONS
+        ])
+
         await update.message.reply_text(
             "✅ Bazadagi ma'lumotlar tozalandi.\n"
             "• Xabarlar\n"
@@ -877,77 +3788,113 @@ async def clear_db_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring."
         )
 
-def main():
-    """Start the bot"""
-    try:
-        # Create the Application with custom timeout settings
-        application = (
-            Application.builder()
-            .token(os.getenv('TELEGRAM_BOT_TOKEN'))
-            .build()
-        )
-
-        # Add handlers
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(CommandHandler("mystats", stats_command))
-        application.add_handler(CommandHandler("url", url_command))
-        application.add_handler(CommandHandler("issue", issue_command))
-        application.add_handler(CommandHandler("blacklist", blacklist_command))
-        application.add_handler(CommandHandler("cleardb", clear_db_command))
-        application.add_handler(CallbackQueryHandler(button_callback))
-        
-        # Add handler for edited messages
-        application.add_handler(MessageHandler(
-            filters.UpdateType.EDITED_MESSAGE,
-            handle_edited_message
-        ))
-        
-        # Message handler for all types of messages
-        application.add_handler(MessageHandler(
-            filters.ALL & ~filters.COMMAND & ~filters.UpdateType.EDITED_MESSAGE,
-            handle_message
-        ))
+def build_application(tenant: Tenant, request: HTTPXRequest) -> Application:
+    """Build one tenant's bot Application with all handlers registered"""
+    application = (
+        Application.builder()
+        .token(tenant.token)
+        .request(request)
+        .context_types(ContextTypes(user_data=UserContextData))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .build()
+    )
+    application.bot_data['tenant'] = tenant
+    tenant.application = application
+
+    # Select the tenant, track update offsets and user activity before any other handler runs
+    application.add_handler(TypeHandler(Update, track_update_offset), group=-2)
+    application.add_handler(TypeHandler(Update, track_user_data_access), group=-1)
+
+    # Add handlers
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("mystats", stats_command))
+    application.add_handler(CommandHandler("url", url_command))
+    application.add_handler(CommandHandler("inbox", inbox_command))
+    application.add_handler(CommandHandler("digest", digest_command))
+    application.add_handler(CommandHandler("issue", issue_command))
+    application.add_handler(CommandHandler("blacklist", blacklist_command))
+    application.add_handler(CommandHandler("cleardb", clear_db_command))
+    application.add_handler(CommandHandler("adminstats", admin_stats_command))
+    application.add_handler(CommandHandler("adminexport", admin_export_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("filter", filter_command))
+    application.add_handler(CallbackQueryHandler(button_callback))
+    
+    # Add handler for edited messages
+    application.add_handler(MessageHandler(
+        filters.UpdateType.EDITED_MESSAGE,
+        handle_edited_message
+    ))
+    
+    # Message handler for all types of messages
+    application.add_handler(MessageHandler(
+        filters.ALL & ~filters.COMMAND & ~filters.UpdateType.EDITED_MESSAGE,
+        handle_message
+    ))
+
+    # Error handler
+    application.add_error_handler(error_handler)
 
-        # Error handler
-        application.add_error_handler(error_handler)
+    # Inline query handler
+    application.add_handler(InlineQueryHandler(inline_query))
+    return application
 
-        # Inline query handler
-        application.add_handler(InlineQueryHandler(inline_query))
+def main():
+    """Start the bots"""
+    try:
+        # One outgoing connection pool for all bots; long polling keeps a
+        # connection of its own per bot
+        request = HTTPXRequest(connection_pool_size=BOT_CONNECTION_POOL_SIZE)
+        applications = [build_application(tenant, request) for tenant in tenants]
 
-        logger.info("Starting bot...")
+        logger.info(f"Starting {len(applications)} bot(s)...")
 
         # Set up bot commands
         commands = [
             BotCommand("start", "🚀 Botni ishga tushirish"),
             BotCommand("mystats", "📊 Statistikani ko'rish"),
+            BotCommand("inbox", "📥 Xabarlar tarixi"),
             BotCommand("url", "🔄 Yangi havola yaratish"),
             BotCommand("blacklist", "🗑 Bloklash ro'yxatini tozalash"),
+            BotCommand("digest", "📦 Xabarlarni jamlashni yoqish/o'chirish"),
             BotCommand("issue", "💭 Taklif yuborish")
         ]
-        
-        # Set commands before starting polling
-        asyncio.get_event_loop().run_until_complete(
-            application.bot.set_my_commands(commands)
-        )
 
-        # Start the bot
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+        # Start the bots
+        return asyncio.get_event_loop().run_until_complete(run_bot(applications, commands))
         
     except Exception as e:
         logger.error(f"Critical error in main: {e}")
         raise
 
 if __name__ == '__main__':
+    handed_over = False
+    handoff_failed = False
     try:
-        main()
+        handed_over = main()
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
+    except HandoffFailed as e:
+        logger.error(f"Not starting, the running instance kept polling: {e}")
+        handoff_failed = True
     except Exception as e:
         logger.error(f"Bot stopped due to error: {e}")
     finally:
         # Clean up
         try:
             client.close()  # Close MongoDB connection
+            write_journal.close()
             logger.info("Cleanup completed")
         except Exception as e:
-            logger.error(f"Error during cleanup: {e}") 
\ No newline at end of file
+            logger.error(f"Error during cleanup: {e}")
+        # Flush queued log records
+        log_listener.stop() 
+
+    if handed_over:
+        # Tells the supervisor not to restart this instance
+        sys.exit(HANDOFF_EXIT_CODE)
+    if handoff_failed:
+        # Marks the deploy as failed without restarting into the same conflict
+        sys.exit(HANDOFF_FAILED_EXIT_CODE)
@@ -19,16 +19,35 @@ curl -sL https://deb.nodesource.com/setup_18.x | sudo -E bash -
 sudo apt-get install -y nodejs
 sudo npm install pm2 -g
 
-# Create PM2 config
+# Create PM2 config: two slots of the same bot, only one of which runs at a
+# time; bash handoff.sh restarts without downtime by moving it to the other slot.
+# An instance that handed over exits with 75, which must not be restarted;
+# neither must one that failed to take over (76).
 echo '{
   "apps": [{
-    "name": "anonimvaqti-bot",
+    "name": "anonimvaqti-bot-blue",
     "script": "bot.py",
     "interpreter": "./venv/bin/python3.9",
-    "watch": true,
+    "watch": false,
     "time": true,
     "instances": 1,
     "autorestart": true,
+    "stop_exit_codes": [75, 76],
+    "kill_timeout": 15000,
+    "max_restarts": 10,
+    "error_file": "logs/err.log",
+    "out_file": "logs/out.log",
+    "log_date_format": "YYYY-MM-DD HH:mm Z"
+  }, {
+    "name": "anonimvaqti-bot-green",
+    "script": "bot.py",
+    "interpreter": "./venv/bin/python3.9",
+    "watch": false,
+    "time": true,
+    "instances": 1,
+    "autorestart": true,
+    "stop_exit_codes": [75, 76],
+    "kill_timeout": 15000,
     "max_restarts": 10,
     "error_file": "logs/err.log",
     "out_file": "logs/out.log",
@@ -40,4 +59,4 @@ echo '{
 mkdir -p logs
 
 # Start the bot with PM2
-pm2 start ecosystem.config.json 
\ No newline at end of file
+pm2 start ecosystem.config.json --only anonimvaqti-bot-blue 
\ No newline at end of file
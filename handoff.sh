@@ -0,0 +1,64 @@
+#!/bin/bash
+
+# Restart the bot without downtime: start it in the idle slot, which takes
+# over polling from the running one. The old instance drains and exits with
+# code 75, which the supervisor treats as a clean stop and doesn't restart.
+# If the old instance doesn't hand over, the new one exits with code 76
+# instead of polling next to it, and this script fails.
+# Usage: bash handoff.sh [systemd|pm2]
+
+set -e
+
+SUPERVISOR=${1:-systemd}
+# The bot's handoff timeout plus the old instance's drain
+WAIT_SECONDS=45
+
+if [ "$SUPERVISOR" = "pm2" ]; then
+    BLUE_PID=$(pm2 pid anonimvaqti-bot-blue)
+    if [ -n "$BLUE_PID" ] && [ "$BLUE_PID" != "0" ]; then
+        OLD=blue NEW=green
+    else
+        OLD=green NEW=blue
+    fi
+    pm2 start ecosystem.config.json --only "anonimvaqti-bot-$NEW"
+
+    for _ in $(seq "$WAIT_SECONDS"); do
+        sleep 1
+        NEW_PID=$(pm2 pid "anonimvaqti-bot-$NEW")
+        OLD_PID=$(pm2 pid "anonimvaqti-bot-$OLD")
+        if [ -z "$NEW_PID" ] || [ "$NEW_PID" = "0" ]; then
+            echo "Handoff failed: the $OLD slot kept polling, see logs/err.log" >&2
+            exit 1
+        fi
+        if [ -z "$OLD_PID" ] || [ "$OLD_PID" = "0" ]; then
+            pm2 save
+            echo "The $NEW slot took over; the $OLD slot has exited"
+            exit 0
+        fi
+    done
+else
+    if systemctl is-active --quiet anonimvaqti-bot@blue; then
+        OLD=blue NEW=green
+    else
+        OLD=green NEW=blue
+    fi
+    sudo systemctl start "anonimvaqti-bot@$NEW"
+
+    for _ in $(seq "$WAIT_SECONDS"); do
+        sleep 1
+        if systemctl is-failed --quiet "anonimvaqti-bot@$NEW"; then
+            echo "Handoff failed: the $OLD slot kept polling, see /var/log/anonimvaqti-bot.log" >&2
+            exit 1
+        fi
+        if ! systemctl is-active --quiet "anonimvaqti-bot@$OLD"; then
+            # Boot into the slot that now runs the bot
+            sudo systemctl enable "anonimvaqti-bot@$NEW"
+            sudo systemctl disable "anonimvaqti-bot@$OLD"
+            echo "The $NEW slot took over; the $OLD slot has exited"
+            exit 0
+        fi
+    done
+fi
+
+echo "The $NEW slot is running but the $OLD slot hasn't exited after ${WAIT_SECONDS}s" >&2
+exit 1
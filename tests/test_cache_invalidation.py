@@ -0,0 +1,222 @@
+"""Cache invalidation: change documents through the watcher, the bus and the caches.
+
+Changes are pushed through LocalChangeSource (or read from stand-in change
+streams and collections), so no MongoDB server is needed.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+os.environ.setdefault('MONGODB_URI', 'mongodb://localhost:27017')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '1:soak')
+os.environ.setdefault('JOURNAL_PATH', os.path.join(tempfile.mkdtemp(), 'bot.journal.sqlite3'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+import bot
+
+class FakeStream:
+    """Change stream stand-in returning queued changes, then None"""
+
+    def __init__(self, changes: list, resume_token=None, error: Exception = None):
+        self.changes = list(changes)
+        self.resume_token = resume_token
+        self.error = error
+        self.closed = False
+
+    def try_next(self):
+        if self.error:
+            raise self.error
+        return self.changes.pop(0) if self.changes else None
+
+    def close(self):
+        self.closed = True
+
+class FakeCollection:
+    """Just enough of a pymongo collection for PollingSource.fetch_changes"""
+
+    def __init__(self, documents: list):
+        self.full_name = 'test.users'
+        self.documents = documents
+
+    def find(self, query: dict):
+        (field, condition), = query.items()
+        return [d for d in self.documents if d.get(field) in condition['$in']]
+
+def fresh_collections() -> dict:
+    tenant = bot.tenants[0]
+    for collection in tenant.collections.values():
+        collection.cache.clear()
+        collection.ids.clear()
+    return tenant.collections
+
+def change(operation: str, collection: str, document_id, document: dict = None, **extra) -> dict:
+    return dict({
+        'operationType': operation,
+        'ns': {'db': bot.tenants[0].db.name, 'coll': collection},
+        'documentKey': {'_id': document_id},
+        'fullDocument': document
+    }, **extra)
+
+async def publish_local(changes: list) -> list:
+    """Push changes through a running watcher and return the published events"""
+    published = asyncio.Queue()
+    bot.invalidation_bus.subscribe(published.put_nowait)
+    watcher = asyncio.create_task(bot.run_invalidation_watcher())
+    try:
+        await asyncio.sleep(0)
+        for item in changes:
+            bot.invalidation_source.push(item)
+        return await asyncio.wait_for(published.get(), 5)
+    finally:
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        bot.invalidation_bus.subscribers.remove(published.put_nowait)
+
+def test_local_changes_refresh_the_caches(monkeypatch):
+    monkeypatch.setattr(bot, 'INVALIDATION_SOURCE', 'local')
+    collections = fresh_collections()
+    blocked_id, user_id, wiped_id = ObjectId(), ObjectId(), ObjectId()
+    collections['blocked']._remember(None, {'_id': blocked_id, 'user_id': 10, 'blocked_users': [20]})
+    collections['users']._remember(None, {'_id': user_id, 'user_id': 1, 'link_code': 'old'})
+    collections['users']._remember(None, {'_id': wiped_id, 'user_id': 2, 'link_code': 'gone'})
+    bot.tenants[0].admin_stats_cache['data'] = {'total_users': 2}
+
+    events = asyncio.run(publish_local([
+        change('update', 'blocked', blocked_id, {'_id': blocked_id, 'user_id': 10, 'blocked_users': [20, 30]}),
+        change('replace', 'users', user_id, {'_id': user_id, 'user_id': 1, 'link_code': 'new'}),
+        change('delete', 'users', wiped_id),
+        change('insert', 'users', ObjectId(), {'_id': ObjectId(), 'user_id': 3, 'link_code': 'uncached'}),
+        change('update', 'messages', ObjectId(), {})
+    ]))
+
+    assert [event.kind for event in events] == [
+        bot.BLOCK_ADDED, bot.LINK_CODE_ROTATED, bot.USER_WIPED, bot.DOCUMENT_CHANGED
+    ]
+    assert events[0].details == {'added': [30], 'removed': []}
+    assert events[1].details == {'old_link_code': 'old', 'link_code': 'new'}
+    assert collections['blocked'].cache[('user_id', 10)]['blocked_users'] == [20, 30]
+    assert collections['users'].cache[('link_code', 'new')]['user_id'] == 1
+    assert ('link_code', 'old') not in collections['users'].cache
+    assert collections['users'].cache[('user_id', 2)] is None
+    # Documents nobody looked up stay out of the cache
+    assert ('user_id', 3) not in collections['users'].cache
+    assert bot.tenants[0].admin_stats_cache['data'] is None
+
+def test_local_collection_drop_resets_the_cache(monkeypatch):
+    monkeypatch.setattr(bot, 'INVALIDATION_SOURCE', 'local')
+    collections = fresh_collections()
+    collections['blocked']._remember(None, {'_id': ObjectId(), 'user_id': 10, 'blocked_users': [20]})
+
+    events = asyncio.run(publish_local([
+        {'operationType': 'drop', 'ns': {'db': bot.tenants[0].db.name, 'coll': 'blocked'}}
+    ]))
+
+    assert [event.kind for event in events] == [bot.COLLECTION_RESET]
+    assert not collections['blocked'].cache
+
+def test_unblock_of_uncached_blocklist_is_classified_by_fields():
+    fresh_collections()
+    document_id = ObjectId()
+    removed = bot.classify_change(change('update', 'blocked', document_id,
+                                         {'_id': document_id, 'user_id': 10, 'blocked_users': []}))
+    added = bot.classify_change(change('update', 'blocked', document_id,
+                                       {'_id': document_id, 'user_id': 10, 'blocked_users': [20]},
+                                       updateDescription={'updatedFields': {'blocked_users.0': 20}}))
+    other_database = bot.classify_change(dict(change('delete', 'users', document_id),
+                                              ns={'db': 'elsewhere', 'coll': 'users'}))
+
+    assert removed.kind == bot.BLOCK_REMOVED
+    assert added.kind == bot.BLOCK_ADDED
+    assert other_database is None
+
+def test_change_stream_resume_tokens_advance_on_commit(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, 'INVALIDATION_STATE_FILE', str(tmp_path / 'invalidation.json'))
+    database = bot.tenants[0].db.name
+    source = bot.ChangeStreamSource({database: 'start'})
+    source.streams[database] = FakeStream([{'operationType': 'insert'}], resume_token='next')
+
+    assert source.read_batch() == [{'operationType': 'insert'}]
+    # Nothing is resumed past until the changes have been published
+    assert source.resume_tokens == {database: 'start'}
+
+    source.commit()
+    source.close()
+    assert source.resume_tokens == {database: 'next'}
+    assert bot.load_resume_tokens() == {database: 'next'}
+
+def test_change_stream_read_error_rewinds_to_published_position(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, 'INVALIDATION_STATE_FILE', str(tmp_path / 'invalidation.json'))
+    database = bot.tenants[0].db.name
+    stream = FakeStream([], resume_token='unpublished', error=RuntimeError('cursor killed'))
+    source = bot.ChangeStreamSource({database: 'start'})
+    source.streams[database] = stream
+    source.read_tokens[database] = 'unpublished'
+
+    try:
+        source.read_batch()
+        assert False, "read_batch should have raised"
+    except RuntimeError:
+        pass
+
+    assert stream.closed and not source.streams
+    assert source.read_tokens == {database: 'start'}
+
+def test_change_stream_lost_history_resets_tenant_caches(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, 'INVALIDATION_STATE_FILE', str(tmp_path / 'invalidation.json'))
+    database = bot.tenants[0].db.name
+    source = bot.ChangeStreamSource({database: 'expired'})
+    source.streams[database] = FakeStream([], error=OperationFailure('history lost', code=286))
+
+    changes = source.read_batch()
+
+    assert {c['ns']['coll'] for c in changes} == set(bot.INVALIDATION_COLLECTIONS)
+    assert all(bot.classify_change(c).kind == bot.COLLECTION_RESET for c in changes)
+    assert database not in source.resume_tokens and not source.streams
+
+def test_watcher_falls_back_to_polling_when_change_streams_are_denied(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, 'INVALIDATION_SOURCE', 'auto')
+    monkeypatch.setattr(bot, 'INVALIDATION_STATE_FILE', str(tmp_path / 'invalidation.json'))
+
+    def denied(self, tenant):
+        raise OperationFailure('not authorized to execute command aggregate', code=13)
+    monkeypatch.setattr(bot.ChangeStreamSource, 'open', denied)
+
+    async def run() -> object:
+        watcher = asyncio.create_task(bot.run_invalidation_watcher())
+        try:
+            for _ in range(100):
+                await asyncio.sleep(0.05)
+                if isinstance(bot.invalidation_source, bot.PollingSource):
+                    break
+            return bot.invalidation_source
+        finally:
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+
+    assert isinstance(asyncio.run(run()), bot.PollingSource)
+
+def test_polling_reports_changed_and_deleted_documents():
+    kept, changed, deleted = ObjectId(), ObjectId(), ObjectId()
+    current = [
+        {'_id': kept, 'user_id': 1, 'link_code': 'a'},
+        {'_id': changed, 'user_id': 2, 'link_code': 'new'}
+    ]
+    collection = bot.ResilientCollection(FakeCollection(current), key_fields=('user_id',))
+    tenant = SimpleNamespace(db=SimpleNamespace(name='test'), collections={'users': collection})
+    cached = [
+        (('user_id', 1), {'_id': kept, 'user_id': 1, 'link_code': 'a'}),
+        (('user_id', 2), {'_id': changed, 'user_id': 2, 'link_code': 'old'}),
+        (('user_id', 3), {'_id': deleted, 'user_id': 3, 'link_code': 'c'})
+    ]
+
+    changes = bot.PollingSource.fetch_changes(tenant, 'users', cached)
+
+    assert [(c['operationType'], c['documentKey']['_id']) for c in changes] == [
+        ('replace', changed), ('delete', deleted)
+    ]
+    assert changes[0]['fullDocument']['link_code'] == 'new'
@@ -0,0 +1,97 @@
+"""Soak test: resident per-user context data stays flat under long synthetic load.
+
+Drives track_user_data_access and sweep_user_data with a stream of mostly
+one-off users plus a stable set of returning ones, and samples traced
+memory with tracemalloc. Runs under pytest, or directly for a longer soak:
+
+    python tests/test_user_data_soak.py 2000000
+"""
+import asyncio
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+
+os.environ.setdefault('MONGODB_URI', 'mongodb://localhost:27017')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '1:soak')
+os.environ.setdefault('JOURNAL_PATH', os.path.join(tempfile.mkdtemp(), 'bot.journal.sqlite3'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.ext import Application, CallbackContext, ContextTypes
+
+import bot
+
+SOAK_UPDATES = 300000
+SOAK_SAMPLES = 20
+SOAK_MAX_USERS = 5000
+SOAK_RETURNING_USERS = 2000
+# Allowed growth of traced memory after the first quarter of the run
+SOAK_GROWTH_RATIO = 0.1
+SOAK_GROWTH_SLACK_BYTES = 256 * 1024
+
+async def run_soak(updates: int) -> tuple:
+    """Feed synthetic updates and return the memory samples and final metrics"""
+    application = (
+        Application.builder()
+        .token(os.environ['TELEGRAM_BOT_TOKEN'])
+        .context_types(ContextTypes(user_data=bot.UserContextData))
+        .build()
+    )
+    sample_every = max(updates // SOAK_SAMPLES, 1)
+    samples = []
+
+    tracemalloc.start()
+    try:
+        for update_number in range(updates):
+            # One update in four comes from a returning user, the rest from new ones
+            if update_number % 4 == 0:
+                user_id = update_number % SOAK_RETURNING_USERS
+            else:
+                user_id = SOAK_RETURNING_USERS + update_number
+            context = CallbackContext(application, user_id=user_id)
+            context.user_data['reply_to'] = update_number
+            update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+            await bot.track_user_data_access(update, context)
+
+            if update_number % sample_every == 0:
+                bot.sweep_user_data(application)
+                gc.collect()
+                samples.append(tracemalloc.get_traced_memory()[0])
+    finally:
+        tracemalloc.stop()
+
+    return samples, bot.get_user_data_metrics(application), application
+
+def check_flat(samples: list) -> tuple:
+    """Compare the peak after warm-up with the first post-warm-up sample"""
+    warm = samples[len(samples) // 4:]
+    limit = int(warm[0] * (1 + SOAK_GROWTH_RATIO)) + SOAK_GROWTH_SLACK_BYTES
+    return max(warm), limit
+
+def test_user_data_memory_stays_flat():
+    max_users = bot.USER_DATA_MAX_USERS
+    bot.USER_DATA_MAX_USERS = SOAK_MAX_USERS
+    try:
+        samples, metrics, application = asyncio.run(run_soak(SOAK_UPDATES))
+    finally:
+        bot.USER_DATA_MAX_USERS = max_users
+
+    peak, limit = check_flat(samples)
+    assert peak <= limit, f"traced memory grew to {peak} bytes, limit {limit}"
+    assert metrics['resident_users'] <= SOAK_MAX_USERS
+    assert len(application.user_data) == metrics['resident_users']
+    # The first one-off user was evicted long ago
+    assert SOAK_RETURNING_USERS + 1 not in application.user_data
+
+if __name__ == '__main__':
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else SOAK_UPDATES
+    bot.USER_DATA_MAX_USERS = SOAK_MAX_USERS
+    samples, metrics, _ = asyncio.run(run_soak(updates))
+    peak, limit = check_flat(samples)
+    print(f"{updates} updates, {metrics['resident_users']} resident users (~{metrics['estimated_bytes']} bytes)")
+    print("traced memory samples:", " ".join(f"{sample // 1024}K" for sample in samples))
+    print(f"peak after warm-up {peak // 1024}K, limit {limit // 1024}K: {'flat' if peak <= limit else 'GROWING'}")
+    bot.log_listener.stop()
+    sys.exit(0 if peak <= limit else 1)